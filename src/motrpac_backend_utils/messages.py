@@ -3,15 +3,18 @@
 Contains the messaging functions for the backend. When using this,
 make sure that package features "messaging" or "zipper" are used.
 """
-import json
 import logging
+from functools import cache
 
 from google.api_core.exceptions import GoogleAPICallError
 from google.auth.transport.requests import AuthorizedSession
 from google.cloud.pubsub_v1 import PublisherClient
+from google.cloud.pubsub_v1.publisher.futures import Future
+from google.cloud.pubsub_v1.types import BatchSettings
 from google.protobuf.message import Error
 from opentelemetry import trace
 from opentelemetry.instrumentation.utils import http_status_to_status_code
+from opentelemetry.propagate import inject
 from opentelemetry.trace import Status
 
 from .proto import FileDownloadMessage, UserNotificationMessage
@@ -19,19 +22,37 @@ from .requester import Requester
 from .utils import get_authorized_session
 
 logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
 
+# the batching of the default PublisherClient, messages published within 50 ms of each
+# other are sent together
+PUBLISH_BATCH_SETTINGS = BatchSettings(
+    max_bytes=40_000,
+    max_latency=0.05,
+    max_messages=100,
+)
 
-def decode_file_download_message(message: bytes) -> tuple[list[str], Requester]:
+# the authorized sessions used to send notifications, keyed by the notification URL (the
+# audience of the session's credentials), reused so connections and tokens are too
+_notification_sessions: dict[str, AuthorizedSession] = {}
+
+
+def decode_file_download_message(
+    message: bytes | bytearray | memoryview,
+) -> tuple[list[str], Requester]:
     """
-    Parses a File Download Protobuf message into a List of requested files and a named
-    tuple of type Requester.
+    Parses a File Download Protobuf message into a List of requested files and a
+    Requester.
 
-    :param message: The Protobuf message (encoded as bytes)
+    :param message: The Protobuf message (encoded as bytes, or any bytes-like object,
+        which is parsed without being copied into bytes)
     :return: The decoded message
     """
+    # the protobuf parser takes bytes or a memoryview, but not a bytearray
+    if isinstance(message, bytearray):
+        message = memoryview(message)
     try:
-        message_data = FileDownloadMessage()
-        message_data.ParseFromString(message)
+        message_data = FileDownloadMessage.FromString(message)
         requested_files = list(message_data.files)
         requester = Requester.from_proto(message_data.requester)
     except Error as e:
@@ -41,61 +62,91 @@ def decode_file_download_message(message: bytes) -> tuple[list[str], Requester]:
     return requested_files, requester
 
 
+def _log_publish_result(future: Future) -> None:
+    """
+    Logs the outcome of publishing a message, as a done callback of the publish future.
+
+    :param future: The completed publish future
+    """
+    if (error := future.exception()) is not None:
+        logger.error("Failed to publish message: %s", error)
+    else:
+        logger.info("Published message ID: %s", future.result())
+
+
+@cache
+def _get_default_publisher_client() -> PublisherClient:
+    """
+    Gets the PublisherClient used when one is not passed in, creating it on first use so
+    its channel and batches are shared by every publish.
+
+    :return: The default PublisherClient
+    """
+    return PublisherClient(batch_settings=PUBLISH_BATCH_SETTINGS)
+
+
 def publish_file_download_message(
     name: str,
     user_id: str | None,
     email: str,
     files: list[str],
     topic_id: str,
-    client: PublisherClient,
-) -> None:
+    client: PublisherClient | None = None,
+    *,
+    await_result: bool = True,
+) -> Future:
     """
-    Publishes a FileDownloadMessage protobuf message to the topic id provided.
+    Publishes a FileDownloadMessage protobuf message to the topic id provided. By default
+    this waits for the message to be published, with `await_result=False` it returns
+    right away so the client can batch messages, and the message ID (or the error) is
+    logged once it has been published.
 
     :param name: The name of the requester
     :param user_id: The ID of the requester
     :param email: The email of the requester
     :param files: A list of files that are being downloaded
     :param topic_id: The Pub/Sub topic to publish messages to
-    :param client: The Pub/Sub PublisherClient
-    :return:
+    :param client: The Pub/Sub PublisherClient. If not provided, a client is created on
+        first use and reused by later calls, a client should not be created per message
+    :param await_result: Whether to wait for the message to be published before
+        returning, which raises if publishing failed. Defaults to True
+    :return: The future of the publish, which resolves to the published message ID
     """
-    try:
-        # Instantiate a protoc-generated class defined in `us-states.proto`.
-        message = FileDownloadMessage()
-        message.files.extend(files)
-        message.requester.CopyFrom(
-            Requester(name=name, email=email, id=user_id).to_proto(
-                FileDownloadMessage.Requester,
-            ),
-        )
-        # Encode the data according to the message serialization type.
-        msg_data = message.SerializeToString()
-        logger.debug("Preparing a binary-encoded message:\n%s", msg_data)
-
-        tracer = trace.get_tracer(__name__)
-
-        # Create a new span and yield it
-        with tracer.start_as_current_span(
-            f"{topic_id} publisher", attributes={"data": str(msg_data)},
-        ) as span:
-            try:
-                attrs = {
-                    "googclient_OpenTelemetrySpanContext": json.dumps(
-                        span.get_span_context().__dict__,
-                    ),
-                }
-                future = client.publish(topic_id, msg_data, **attrs)
-            except GoogleAPICallError as error:
-                if error.code is not None:
-                    span.set_status(Status(http_status_to_status_code(error.code)))
-                raise
-
+    if client is None:
+        client = _get_default_publisher_client()
+
+    # fill in the requester in place rather than copying it in from a separate message
+    message = FileDownloadMessage(files=files)
+    message.requester.name = name
+    message.requester.email = email
+    if user_id is not None:
+        message.requester.id = user_id
+    # Encode the data according to the message serialization type.
+    msg_data = message.SerializeToString()
+    logger.debug("Preparing a binary-encoded message:\n%s", msg_data)
+
+    # Create a new span and yield it
+    with tracer.start_as_current_span(
+        f"{topic_id} publisher", attributes={"data.size": len(msg_data)},
+    ) as span:
+        try:
+            # propagate the publisher span's context to subscribers as message
+            # attributes, in the format of the globally configured propagator
+            attrs: dict[str, str] = {}
+            inject(attrs)
+            future = client.publish(topic_id, msg_data, **attrs)
+        except GoogleAPICallError as error:
+            if error.code is not None:
+                span.set_status(Status(http_status_to_status_code(error.code)))
+            raise
+
+    if await_result:
+        # errors are raised to the caller here, so they are not also logged by the
+        # done callback
         logger.info("Published message ID: %s", future.result())
-    # pylint: disable=broad-except
-    except Exception as e:
-        logger.exception("Exception occurred while publishing message.")
-        raise e from e
+    else:
+        future.add_done_callback(_log_publish_result)
+    return future
 
 
 def send_notification_message(
@@ -116,30 +167,28 @@ def send_notification_message(
     :param output_filename: The name of the output zip file
     :param manifest: A list of files that were requested
     :param url: The URL to send the notification to
-    :param session: An authorized session (authorized for the URL) to send the message
+    :param session: An authorized session (authorized for the URL) to send the message.
+        If not provided, a session for the URL is created on first use and reused by
+        later calls.
     """
-    try:
-        # create the ProtoBuf message
-        message = UserNotificationMessage()
-        message.requester.CopyFrom(
-            Requester(name=name, email=email, id=user_id).to_proto(
-                UserNotificationMessage.Requester,
-            ),
-        )
-        message.zipfile = output_filename
-        message.files.extend(manifest)
-        # serialize the message to bytes
-        msg_data = message.SerializeToString()
-
+    # create the ProtoBuf message
+    message = UserNotificationMessage(zipfile=output_filename, files=manifest)
+    message.requester.name = name
+    message.requester.email = email
+    if user_id is not None:
+        message.requester.id = user_id
+    # serialize the message to bytes
+    msg_data = message.SerializeToString()
+
+    if session is None:
+        session = _notification_sessions.get(url)
         if session is None:
-            session = get_authorized_session(url)
-        session.post(
-            url=url,
-            data=msg_data,
-            headers={"Content-Type": "application/octet-stream"},
-        )
-
-    # pylint: disable=broad-except
-    except Exception as e:
-        logger.exception("Exception occurred while sending message.")
-        raise e from e
+            session = _notification_sessions.setdefault(
+                url,
+                get_authorized_session(url),
+            )
+    session.post(
+        url=url,
+        data=msg_data,
+        headers={"Content-Type": "application/octet-stream"},
+    )
@@ -1,2 +1,15 @@
+import logging
+
+from google.protobuf.internal import api_implementation
+
 from .file_download_pb2 import FileDownloadMessage
 from .notification_pb2 import UserNotificationMessage
+
+# the pure-Python protobuf runtime is orders of magnitude slower to (de)serialize
+# messages than the native (upb or cpp) ones
+if api_implementation.Type() == "python":
+    logging.getLogger(__name__).warning(
+        "Using the pure-Python protobuf implementation, (de)serializing messages will be "
+        "slow. Unset PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION or set it to 'upb' to use "
+        "the native implementation.",
+    )
@@ -4,7 +4,7 @@ Contains the Requester helper class. When using this, make sure that
 package features "messaging" or "zipper" are used.
 """
 
-from typing import NamedTuple, TypeVar, Any
+from typing import NamedTuple, TypeVar
 
 from google.protobuf.message import Message
 
@@ -21,12 +21,13 @@ U = TypeVar(
 
 class Requester(NamedTuple):
     """
-    A named tuple that represents a single requester.
+    A named tuple that represents a single requester. Requesters are hashable and
+    compare by value, so they can be used as members of a set or keys of a dictionary.
     """
 
     name: str
     email: str
-    id: str | None
+    id: str | None = None
 
     def to_proto(self, parent_cls: U) -> Message:
         """
@@ -61,6 +62,23 @@ class Requester(NamedTuple):
         return hash((self.name, self.email, self.id))
 
     def __eq__(self, other: object) -> bool:
-        if not isinstance(other, type(self)):
-            raise NotImplementedError
+        """
+        Checks if another object is a requester with the same name, email and ID, other
+        types (including plain tuples) are never equal to a requester.
+
+        :param other: The object to compare to
+        :return: Whether the objects are equal
+        """
+        if not isinstance(other, Requester):
+            return False
         return self.name == other.name and self.email == other.email and self.id == other.id
+
+    def __ne__(self, other: object) -> bool:
+        """
+        Checks if another object is not equal to this requester, overridden as the tuple
+        implementation would otherwise compare plain tuples by value.
+
+        :param other: The object to compare to
+        :return: Whether the objects are not equal
+        """
+        return not self == other
@@ -2,22 +2,38 @@
 """
 A utility module for setting up logging and tracing.
 """
+import atexit
 import logging
 import os
+from functools import cache
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+from queue import Queue
 
-from google.cloud.logging import Client as LoggingClient
-from google.cloud.logging_v2.handlers import setup_logging
 from opentelemetry import trace
-from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.instrumentation.urllib3 import URLLib3Instrumentor
 from opentelemetry.propagate import set_global_textmap
-from opentelemetry.propagators.cloud_trace_propagator import CloudTraceFormatPropagator
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
 IS_PROD = bool(int(os.getenv("PRODUCTION_DEPLOYMENT", "0")))
 
+# the span export settings used when neither an argument nor the OTEL_BSP_* environment
+# variable is given, tuned for bursty serverless traffic
+SPAN_EXPORT_DEFAULTS = {
+    "OTEL_BSP_MAX_QUEUE_SIZE": 4096,
+    "OTEL_BSP_SCHEDULE_DELAY": 1000,
+    "OTEL_BSP_MAX_EXPORT_BATCH_SIZE": 256,
+    "OTEL_BSP_EXPORT_TIMEOUT": 10000,
+}
+
+logger = logging.getLogger(__name__)
+
+# the tracer provider set by `setup_logging_and_tracing`, the global tracer provider can
+# only be set once so later calls reuse it
+_tracer_provider: TracerProvider | None = None
+# whether the production span export has been added to the tracer provider, which is
+# only done once
+_prod_tracing_initialized = False
+
 
 def get_hexadecimal_trace_id(trace_id: int) -> str:
     """
@@ -26,7 +42,7 @@ def get_hexadecimal_trace_id(trace_id: int) -> str:
     :param trace_id: The trace id to convert
     :return: The trace id in hexadecimal format
     """
-    return format(trace_id, "032x")
+    return f"{trace_id:032x}"
 
 
 def get_hexadecimal_span_id(span_id: int) -> str:
@@ -36,7 +52,7 @@ def get_hexadecimal_span_id(span_id: int) -> str:
     :param span_id: The span id to convert
     :return: The span id in hexadecimal format
     """
-    return format(span_id, "016x")
+    return f"{span_id:016x}"
 
 
 class TraceIdInjectionFilter(logging.Filter):
@@ -51,63 +67,200 @@ class TraceIdInjectionFilter(logging.Filter):
         """
         super().__init__()
 
-    def format(self, record: logging.LogRecord) -> bool:
+    def filter(self, record: logging.LogRecord) -> bool:
         """
         Add OpenTelemetry span and trace info to the log.
 
-        :param record: The log record to format
-        :return: a JSON formatted string
+        :param record: The log record to add the trace info to
+        :return: True, the record is always logged
         """
-        current_span = trace.get_current_span()
-        if current_span:
-            trace_id = current_span.get_span_context().trace_id
-            span_id = current_span.get_span_context().span_id
-            record.trace = get_hexadecimal_trace_id(trace_id)
-            record.span = get_hexadecimal_span_id(span_id)
-
+        span_context = trace.get_current_span().get_span_context()
+        # there is no active span, leave the record as it is
+        if not span_context.is_valid:
+            return True
+        record.trace = f"{span_context.trace_id:032x}"
+        record.span = f"{span_context.span_id:016x}"
         return True
 
 
-def setup_logging_and_tracing(
+class _InProcessQueueHandler(QueueHandler):
+    """
+    A queue handler for a queue that stays in this process, which queues records as
+    they are, rather than formatting them first and replacing the message with the
+    formatted string, so structured (e.g. dict) messages reach the target handler.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepares a record for queuing, the record is not pickled so it is left as is.
+
+        :param record: The record to queue
+        :return: The unchanged record
+        """
+        return record
+
+
+def _get_span_export_setting(value: float | None, env_var: str) -> float | None:
+    """
+    Gets a span export setting, which is the given value, or None if the environment
+    variable is set (so the BatchSpanProcessor reads it), or otherwise the tuned default.
+
+    :param value: The value passed to `setup_logging_and_tracing`
+    :param env_var: The `OTEL_BSP_*` environment variable for the setting
+    :return: The setting to pass to the BatchSpanProcessor
+    """
+    if value is not None or env_var in os.environ:
+        return value
+    return SPAN_EXPORT_DEFAULTS[env_var]
+
+
+@cache
+def _get_cloud_logging_handler() -> logging.Handler:
+    """
+    Gets the Google Cloud Logging handler, creating the Cloud Logging client on first
+    use so repeated setup calls reuse the same client and handler.
+
+    :return: The Cloud Logging handler, with the trace ID filter attached
+    """
+    # the Google Cloud clients are only imported when needed, they are slow to import and
+    # are not used outside of production
+    from google.cloud.logging import Client as LoggingClient  # noqa: PLC0415
+    from google.cloud.logging_v2.handlers import StructuredLogHandler  # noqa: PLC0415
+
+    handler = LoggingClient().get_default_handler()
+    filters = [TraceIdInjectionFilter(), *handler.filters]
+    if not isinstance(handler, StructuredLogHandler):
+        handler.filters = filters
+        return handler
+
+    # the structured handler (used on Cloud Run and Cloud Functions) serializes and
+    # writes each record to stdout on the logging thread, so hand the records to a
+    # background thread instead. The filters stay on the logging thread, as they read
+    # the trace and request context of that thread.
+    handler.filters = []
+    queue_handler = _InProcessQueueHandler(Queue())
+    queue_handler.filters = filters
+    queue_handler.listener = QueueListener(queue_handler.queue, handler)
+    queue_handler.listener.start()
+    atexit.register(queue_handler.listener.stop)
+    return queue_handler
+
+
+# the settings past log_level are keyword-only, so the number of arguments does not make
+# calls any harder to read
+def setup_logging_and_tracing(  # noqa: PLR0913
     log_level: int = logging.INFO,
     *,
     is_prod: bool = IS_PROD,
+    span_queue_size: int | None = None,
+    span_schedule_delay_ms: float | None = None,
+    span_batch_size: int | None = None,
+    span_export_timeout_ms: float | None = None,
+    dev_log_buffer_size: int = 0,
 ) -> None:
     """
     Setup local logging/Google Cloud Logging and tracing. It reads an environment
     variable called `PRODUCTION_DEPLOYMENT` to determine whether to send logs and
     traces to the Google Cloud Logging and Google Cloud Tracing services. This can be
-    a boolean value, or a string that can be 0 or 1.
+    a boolean value, or a string that can be 0 or 1. The tracer provider is set by the
+    first call, and the production span export is added to it by the first production
+    call, so a development call followed by a production call still exports spans.
+    Later production calls only set up logging, their span export settings are ignored.
+
+    Any of the span export settings that are not given are read from the standard
+    `OTEL_BSP_*` environment variables, falling back to defaults tuned for bursty
+    serverless traffic (a 4096 span queue, a 1000 ms delay, 256 span batches and a
+    10000 ms timeout), rather than the OpenTelemetry defaults, which drop spans on bursts
+    and can hold up shutdown for 30 seconds.
 
     :param log_level: The log level to use. Defaults to logging.INFO
     :param is_prod: Whether to set up logging and tracing for production. Defaults to
         the value of the `PRODUCTION_DEPLOYMENT` environment variable, which defaults
         to False if not set to "1".
+    :param span_queue_size: The maximum number of spans buffered for export in
+        production, spans beyond this are dropped
+    :param span_schedule_delay_ms: The delay between span exports in production
+    :param span_batch_size: The maximum number of spans sent per export in production
+    :param span_export_timeout_ms: The time allowed for a span export in production
+    :param dev_log_buffer_size: Outside of production, the number of records to buffer
+        before writing them out, warnings and errors are always written immediately.
+        Defaults to 0, which writes every record as it is logged
     """
     if is_prod:
-        client = LoggingClient()
-        handler = client.get_default_handler()
-        handler.filters = [TraceIdInjectionFilter(), *handler.filters]
-        setup_logging(handler, log_level=log_level)
+        # slow to import, and only used in production
+        from google.cloud.logging_v2.handlers import setup_logging  # noqa: PLC0415
+
+        setup_logging(_get_cloud_logging_handler(), log_level=log_level)
         logging.getLogger("requests").setLevel(logging.WARNING)
         logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
         logging.getLogger("urllib3.util.retry").setLevel(logging.WARNING)
     else:
         log_format = "%(levelname)s %(asctime)s %(name)s:%(funcName)s:%(lineno)s %(message)s"
-        logging.basicConfig(
-            format=log_format,
-            datefmt="%I:%M:%S %p",
-            level=log_level,
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(log_format, datefmt="%I:%M:%S %p"))
+        if dev_log_buffer_size > 0:
+            handler = MemoryHandler(
+                dev_log_buffer_size,
+                flushLevel=logging.WARNING,
+                target=handler,
+            )
+        logging.basicConfig(handlers=[handler], level=log_level)
+
+    global _tracer_provider, _prod_tracing_initialized  # noqa: PLW0603
+    if _tracer_provider is None:
+        _tracer_provider = TracerProvider()
+        trace.set_tracer_provider(_tracer_provider)
+
+    # setup Google Cloud Tracing if we are in production
+    if is_prod and _prod_tracing_initialized:
+        span_settings = (
+            span_queue_size,
+            span_schedule_delay_ms,
+            span_batch_size,
+            span_export_timeout_ms,
+        )
+        if any(setting is not None for setting in span_settings):
+            logger.warning(
+                "Span export is already set up, the span export settings are ignored",
+            )
+    elif is_prod:
+        _prod_tracing_initialized = True
+        # the exporter, instrumentors and propagator are only needed in production
+        from opentelemetry.exporter.cloud_trace import (  # noqa: PLC0415
+            CloudTraceSpanExporter,
+        )
+        from opentelemetry.instrumentation.requests import (  # noqa: PLC0415
+            RequestsInstrumentor,
+        )
+        from opentelemetry.instrumentation.urllib3 import (  # noqa: PLC0415
+            URLLib3Instrumentor,
+        )
+        from opentelemetry.propagators.cloud_trace_propagator import (  # noqa: PLC0415
+            CloudTraceFormatPropagator,
         )
 
-    # setup tracing/Google Cloud Tracing if we are in production
-    tracer_provider = TracerProvider()
-    trace.set_tracer_provider(tracer_provider)
-    RequestsInstrumentor().instrument()
-    URLLib3Instrumentor().instrument()
-    if is_prod:
+        # only patch the HTTP libraries when the spans they create will be exported, and
+        # only if they have not already been patched, e.g. by the application
+        for instrumentor in (RequestsInstrumentor(), URLLib3Instrumentor()):
+            if not instrumentor.is_instrumented_by_opentelemetry:
+                instrumentor.instrument()
+
         trace_exporter = CloudTraceSpanExporter()
-        trace.get_tracer_provider().add_span_processor(
-            BatchSpanProcessor(trace_exporter),
+        _tracer_provider.add_span_processor(
+            BatchSpanProcessor(
+                trace_exporter,
+                max_queue_size=_get_span_export_setting(
+                    span_queue_size, "OTEL_BSP_MAX_QUEUE_SIZE",
+                ),
+                schedule_delay_millis=_get_span_export_setting(
+                    span_schedule_delay_ms, "OTEL_BSP_SCHEDULE_DELAY",
+                ),
+                max_export_batch_size=_get_span_export_setting(
+                    span_batch_size, "OTEL_BSP_MAX_EXPORT_BATCH_SIZE",
+                ),
+                export_timeout_millis=_get_span_export_setting(
+                    span_export_timeout_ms, "OTEL_BSP_EXPORT_TIMEOUT",
+                ),
+            ),
         )
         set_global_textmap(CloudTraceFormatPropagator())
@@ -2,28 +2,93 @@
 """
 Threadpool utility functions.
 """
-from concurrent.futures import Future, ThreadPoolExecutor
+import os
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextvars import copy_context
 from functools import wraps
-from typing import TypeVar, ParamSpec
+from threading import Lock
+from typing import TypeVar, ParamSpec, overload
 from collections.abc import Callable
 
 
 P = ParamSpec("P")
 R = TypeVar("R")
-_DEFAULT_POOL = ThreadPoolExecutor()
+# the pool used by functions decorated without a pool, created on first use
+_default_pool: ThreadPoolExecutor | None = None
+_default_pool_lock = Lock()
 
 
-def threadpool(wrapped_func: Callable[P, R]) -> Callable[P, Future[R]]:
+def _get_default_pool() -> ThreadPoolExecutor:
     """
-    Decorator that wraps a function and runs it in a threadpool.
+    Gets the default threadpool, creating it on first use.
+
+    :return: The default threadpool
+    """
+    global _default_pool  # noqa: PLW0603
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ThreadPoolExecutor(
+                    max_workers=min(32, (os.cpu_count() or 1) + 4),
+                    thread_name_prefix="motrpac-tp",
+                )
+    return _default_pool
+
+
+def submit_with_context(
+    executor: Executor,
+    fn: Callable[P, R],
+    /,
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> Future[R]:
+    """
+    Submits a function to an executor, running it in a copy of the caller's context so
+    context variables (e.g. the current trace span) are the same as in the caller.
+
+    :param executor: The executor to run the function in
+    :param fn: The function to run
+    :return: The future of the function's result
+    """
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+@overload
+def threadpool(wrapped_func: Callable[P, R]) -> Callable[P, Future[R]]: ...
+
+
+@overload
+def threadpool(
+    wrapped_func: None = None,
+    *,
+    pool: ThreadPoolExecutor | None = None,
+) -> Callable[[Callable[P, R]], Callable[P, Future[R]]]: ...
+
+
+def threadpool(
+    wrapped_func: Callable[P, R] | None = None,
+    *,
+    pool: ThreadPoolExecutor | None = None,
+) -> Callable[P, Future[R]] | Callable[[Callable[P, R]], Callable[P, Future[R]]]:
+    """
+    Decorator that wraps a function and runs it in a threadpool. It can be used as
+    `@threadpool`, to run the function in the shared default threadpool, or as
+    `@threadpool(pool=custom_pool)` to run it in a specific threadpool. The function
+    is submitted with `submit_with_context`, so it sees the caller's context variables.
+
+    :param wrapped_func: The function to wrap
+    :param pool: The threadpool to run the function in, defaults to the shared default
+        threadpool
     :return: The wrapped function.
     """
 
     def decorator(f: Callable[P, R]) -> Callable[P, Future[R]]:
         @wraps(f)
         def wrap(*args: P.args, **kwargs: P.kwargs) -> Future[R]:
-            return _DEFAULT_POOL.submit(f, *args, **kwargs)
+            return submit_with_context(pool or _get_default_pool(), f, *args, **kwargs)
 
         return wrap
 
+    if wrapped_func is None:
+        return decorator
     return decorator(wrapped_func)
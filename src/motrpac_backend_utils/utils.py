@@ -4,10 +4,12 @@ Utility functions for the MoTrPAC backend utility function package. Recursive ut
 """
 
 import os
+from functools import cache
 from hashlib import md5
 
 import google.auth
 from google.auth.compute_engine import IDTokenCredentials
+from google.auth.credentials import Credentials
 from google.auth.transport.requests import AuthorizedSession, Request
 
 
@@ -42,15 +44,32 @@ def get_authorized_session(
     credentials
     :return: An AuthorizedSession instance to use to make requests to Google services
     """
-    if bool(int(os.getenv("PRODUCTION_DEPLOYMENT", "0"))):
-        request = Request()
-        credentials = IDTokenCredentials(request=request, target_audience=audience)
-    else:
-        credentials, _ = google.auth.default()
-
+    credentials = _get_credentials(
+        audience,
+        is_prod=bool(int(os.getenv("PRODUCTION_DEPLOYMENT", "0"))),
+    )
     return AuthorizedSession(credentials, max_refresh_attempts=max_refresh_attempts)
 
 
+@cache
+def _get_credentials(audience: str, *, is_prod: bool) -> Credentials:
+    """
+    Gets the credentials for an audience, cached so that the (metadata server) lookup
+    is only done once per audience. The credentials refresh their own tokens when they
+    expire, so they are safe to share between sessions.
+
+    :param audience: The HTTP endpoint of the service being accessed
+    :param is_prod: Whether to get ID token credentials from the metadata server, or the
+        application default credentials
+    :return: The credentials
+    """
+    if is_prod:
+        request = Request()
+        return IDTokenCredentials(request=request, target_audience=audience)
+    credentials, _ = google.auth.default()
+    return credentials
+
+
 def generate_file_hash(files: list[str]) -> tuple[list[str], str]:
     """
     Gets the MD5 hash of a list of files, generating the hash by sorting the list of files.
@@ -7,40 +7,139 @@ When using this, make sure that package feature "zipper" is used.
 """
 
 #  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+import fcntl
+import io
 import json
 import logging
 import math
 import os
-import shutil
 import time
-from concurrent.futures import Future, as_completed
-from copy import deepcopy
+import warnings
+from collections import defaultdict
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
 from datetime import datetime, UTC
+from itertools import islice
 from multiprocessing import JoinableQueue, Process, Value
 from pathlib import Path
-from tempfile import SpooledTemporaryFile
-from typing import TypedDict
-from zipfile import ZIP_DEFLATED, ZipFile
+from queue import Full
+from typing import Final, Literal, TypedDict
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 from google.cloud.pubsub_v1.subscriber.message import Message
-from google.cloud.storage import Client as StorageClient
+from google.cloud.storage import Blob, Client as StorageClient
+from google.cloud.storage import transfer_manager
 from opentelemetry import trace
-from psutil import virtual_memory
+from requests.adapters import HTTPAdapter
 from smart_open import open
 
 from motrpac_backend_utils.messages import send_notification_message
 from motrpac_backend_utils.requester import Requester
 from motrpac_backend_utils.threadpool import threadpool
-from .utils import get_path_dict
+from .utils import (
+    MANIFEST_ERROR_SUFFIX,
+    add_to_path_dict,
+    default_to_regular,
+    nested_dict,
+)
 from .cache import InProgressCache, LastMessage, RequesterSet
 
 
 MAX_IN_PROGRESS = max(os.cpu_count() - 3 or 1, 1)
+# The maximum number of downloaded files waiting to be added to the archive. Once the
+# queue is full, handing off files blocks until the zip process catches up.
+MAX_QUEUED_FILES = 2 * MAX_IN_PROGRESS
+# The size of each part of the resumable upload of the archive to GCS, in bytes. Larger
+# parts mean fewer requests at the cost of more memory held per upload; throughput
+# flattens out at around 8 MiB. Must be a multiple of 256 KiB, which whole MiB always are.
+UPLOAD_PART_SIZE = int(os.environ.get("MOTRPAC_UPLOAD_PART_MIB", "8")) * 1024 * 1024
+# Files larger than this are downloaded as several concurrent range requests, a single
+# stream per file does not saturate the network for a handful of very large files
+SLICED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+SLICED_DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+MAX_SLICES_PER_FILE = 8
+# The number of connections kept open to GCS by each storage client, the default of 10
+# is far fewer than the concurrent (and sliced) downloads, which would otherwise open
+# and discard a new connection for most requests
+STORAGE_CONNECTION_POOL_SIZE = 64
+# Directories that at least this many files are requested from are listed up front to
+# get the files' metadata, a listing page covers up to 1000 files, but for only a few
+# files fetching each one's metadata is cheaper than paging through a large directory
+LIST_DIRECTORY_MIN_FILES = 16
+# The maximum number of files downloaded at once for a single zip file, keeps large
+# requests from exhausting file descriptors and connections
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("MOTRPAC_DL_CONCURRENCY", "32"))
+# The longest ack deadline extension, in seconds, Pub/Sub allows at most 600 seconds
+MAX_ACK_EXTENSION = 600
+# Put in the queue to tell the zip process there are no more files to add
+END_OF_FILES: Final = False
+
+# Files with these extensions are already compressed, deflating them again costs CPU
+# time for little to no reduction in size, so they are stored in the archive as-is
+COMPRESSED_FILE_EXTENSIONS = (
+    ".gz",
+    ".bgz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".zip",
+    ".bam",
+    ".cram",
+    ".bw",
+    ".bigwig",
+    ".tbi",
+    ".csi",
+    ".png",
+    ".jpg",
+    ".jpeg",
+)
 
 # setup local logging/Google Cloud Logging
 logger = logging.getLogger()
 tracer = trace.get_tracer(__name__)
 
+# the storage client of the current process, keyed by the PID so a forked child process
+# does not reuse the parent's connections
+_storage_client: tuple[int, StorageClient] | None = None
+
+
+class _PooledHTTPAdapter(HTTPAdapter):
+    """An HTTP adapter with a connection pool of `STORAGE_CONNECTION_POOL_SIZE`."""
+
+    def __init__(self) -> None:
+        super().__init__(
+            pool_connections=STORAGE_CONNECTION_POOL_SIZE,
+            pool_maxsize=STORAGE_CONNECTION_POOL_SIZE,
+        )
+
+
+def mount_connection_pool(client: StorageClient) -> None:
+    """
+    Mounts a connection pool of `STORAGE_CONNECTION_POOL_SIZE` connections on a Storage
+    client, unless it already has one, so its existing connections are kept.
+
+    :param client: The Storage client
+    """
+    session = client._http  # noqa: SLF001
+    if not isinstance(session.adapters.get("https://"), _PooledHTTPAdapter):
+        session.mount("https://", _PooledHTTPAdapter())
+
+
+def get_storage_client() -> StorageClient:
+    """
+    Gets the Storage client shared by the current process, creating it on first use.
+
+    :return: The Storage client
+    """
+    global _storage_client  # noqa: PLW0603
+    pid = os.getpid()
+    if _storage_client is None or _storage_client[0] != pid:
+        client = StorageClient()
+        mount_connection_pool(client)
+        _storage_client = (pid, client)
+    return _storage_client[1]
+
 
 class BlobNotFoundError(Exception):
     """Raised when the specified blob could not be found."""
@@ -63,11 +162,12 @@ class ZipProcessResult(TypedDict):
 
 
 def zip_file_writer(
-    queue: "JoinableQueue[str | bool]",
+    queue: "JoinableQueue[str | Literal[False]]",
     archive: ZipFile,
     file_hash: str,
     processed_counter: type[Value] | None,
     file_path_prefix: Path,
+    path_dict: defaultdict | None = None,
 ) -> list[str]:
     """
     Writes files to a zip archive.
@@ -79,8 +179,14 @@ def zip_file_writer(
     :param processed_counter: A `Value` object representing the number of files processed.
     :param file_path_prefix: A `Path` object representing the prefix of the file paths
         to be added to the archive.
+    :param path_dict: If given, a nested dictionary (see `nested_dict`) that each file
+        added to the archive is also added to, building the nested manifest as files
+        arrive rather than all at once at the end.
     """
     manifest: list[str] = []
+    # we want to strip "/tmp/file_cache" or whatever the base name of the location of
+    # the downloaded files is from the names in the archive
+    prefix = f"{str(file_path_prefix).rstrip('/')}/"
 
     while True:
         # get the latest message from the shared process queue
@@ -94,29 +200,36 @@ def zip_file_writer(
             if isinstance(f, BlobNotFoundError):
                 raise f  # noqa: TRY301
             # sentinel to tell the multiprocessing to stop processing
-            if isinstance(f, bool) and not f:
+            if f is END_OF_FILES:
                 break
             # create a file in the archive
             archive.write(
                 f,
-                # we want to replace "/tmp/file_cache" or whatever the base name of the
-                # location of the downloaded files are
-                arcname=f.replace(f"{str(file_path_prefix).rstrip('/')}/", ""),
+                arcname=f.removeprefix(prefix),
+                # use the archive's default compression unless the file is already
+                # compressed
+                compress_type=(
+                    ZIP_STORED
+                    if f.lower().endswith(COMPRESSED_FILE_EXTENSIONS)
+                    else None
+                ),
             )
             manifest.append(f)
+            if path_dict is not None:
+                add_to_path_dict(path_dict, f)
             logger.debug("[File Hash: %s] Finished archiving %s", file_hash, f)
         except BlobNotFoundError as e:
             logger.exception(
                 "[File Hash: %s] Error while adding file to archive",
                 file_hash,
             )
-            manifest.append(f"{e.blob_name} [Error: unable to retrieve file]")
+            manifest.append(f"{e.blob_name}{MANIFEST_ERROR_SUFFIX}")
         except Exception:
             logger.exception(
                 "[File Hash: %s] Error while adding file to archive",
                 file_hash,
             )
-            manifest.append(f"{f} [Error: unable to retrieve file]")
+            manifest.append(f"{f}{MANIFEST_ERROR_SUFFIX}")
         finally:
             queue.task_done()
             if processed_counter is not None:
@@ -138,33 +251,46 @@ def patch_zip_blob_metadata(
     :param zip_loc: The location of the zip file.
     :param storage_client: The Google Cloud Storage client.
     """
-    bucket = storage_client.get_bucket(output_bucket)
-    zip_blob = bucket.blob(os.path.basename(zip_loc))
+    # a client-side reference, fetching the bucket's metadata is not needed to patch
+    bucket = storage_client.bucket(output_bucket)
+    zip_blob = bucket.blob(os.path.basename(zip_loc))  # noqa: PTH119
     zip_blob.custom_time = datetime.now(UTC)
     zip_blob.patch()
 
 
+def write_json_to_archive(archive: ZipFile, name: str, obj: dict | list) -> None:
+    """
+    Serializes an object as JSON directly into a new file in the archive, without
+    building the whole JSON string in memory first.
+
+    :param archive: The archive to add the file to
+    :param name: The name of the file in the archive
+    :param obj: The object to serialize
+    """
+    with archive.open(name, mode="w") as zf, io.TextIOWrapper(
+        zf,
+        encoding="utf-8",
+    ) as text_out:
+        json.dump(obj, text_out, indent=2)
+
+
 def add_to_zip(
-    tmp_dir: str,
     zip_loc: str,
-    output_bucket: str,
     file_path_prefix: Path,
-    queue: "JoinableQueue[str | bool]",
+    queue: "JoinableQueue[str | Literal[False]]",
     processed_counter: type[Value] | None,
 ) -> bool:
     """
     Adds files to an archive, working asynchronously, with another process which will
     tell it which files to process, and when it is done.
 
-    :param tmp_dir: The name of the local temporary directory
     :param zip_loc: The name of the zip file to be created
-    :param output_bucket: The name of the bucket to upload the final zip file to
     :param file_path_prefix: The local path prefix to strip from the local file paths
     :param queue: A queue to communicate with the parent process
     :param processed_counter: A counter to keep track of how many files have been
         processed
     :returns: True when the process has finished (there are no more messages to process/
-        the queue has delivered a sentinel boolean value of False)
+        the queue has delivered the `END_OF_FILES` sentinel)
     """
     file_hash = os.path.basename(os.path.splitext(zip_loc)[0])  # noqa: PTH119, PTH122
     with tracer.start_as_current_span(file_hash):
@@ -174,52 +300,103 @@ def add_to_zip(
             os.getpid(),
         )
         # Process-local instance of the Storage client.
-        storage_client = StorageClient()
-        upload_buffer_size = 2**8 * 256 * 1024
+        storage_client = get_storage_client()
+
+        # The archive is written straight into the GCS upload stream. The writer is not
+        # seekable, so ZipFile writes each entry's sizes/CRC in a trailing data
+        # descriptor rather than going back to patch the local header.
+        with open(
+            zip_loc,
+            mode="wb",
+            transport_params={
+                "min_part_size": UPLOAD_PART_SIZE,
+                "client": storage_client,
+                # sent with the upload request, rather than patched on afterwards
+                "blob_properties": {"custom_time": datetime.now(UTC)},
+            },
+        ) as gs_out, ZipFile(gs_out, mode="w", compression=ZIP_DEFLATED) as archive:
+            path_dict = nested_dict()
+            manifest = zip_file_writer(
+                queue,
+                archive,
+                file_hash,
+                processed_counter,
+                file_path_prefix,
+                path_dict,
+            )
+            write_json_to_archive(
+                archive,
+                f"{file_hash}.nested.manifest.json",
+                default_to_regular(path_dict),
+            )
+            write_json_to_archive(
+                archive,
+                f"{file_hash}.list.manifest.json",
+                manifest,
+            )
 
-        # Figure out how much memory we have available to allocate the new zip file
-        memory = virtual_memory()
-        free_memory = int(memory.available / MAX_IN_PROGRESS)
-        logger.debug(
-            "[File Hash: %s] Allocating %s GB of memory for temp zip file",
-            file_hash,
-            round(free_memory / (1024**3), 4),
-        )
+        return True
 
-        # A spooled zip file exists in memory, and is written to disk when it reaches a
-        # certain size, which is what we allocated above
-        with SpooledTemporaryFile(max_size=free_memory, dir=tmp_dir) as tmp_file:
-            with ZipFile(tmp_file, mode="w", compression=ZIP_DEFLATED) as archive:
-                manifest = zip_file_writer(
-                    queue,
-                    archive,
-                    file_hash,
-                    processed_counter,
-                    file_path_prefix,
-                )
-                manifest_fn = f"{file_hash}.nested.manifest.json"
-                archive.writestr(
-                    manifest_fn,
-                    json.dumps(get_path_dict(manifest), indent=2),
-                )
-                manifest_fn = f"{file_hash}.list.manifest.json"
-                archive.writestr(manifest_fn, json.dumps(manifest, indent=2))
-
-            with open(
-                zip_loc,
-                mode="wb",
-                transport_params={
-                    "min_part_size": upload_buffer_size,
-                    "client": storage_client,
-                },
-            ) as gs_out:
-                # reset the file pointer to the beginning of the file
-                tmp_file.seek(0)
-                shutil.copyfileobj(tmp_file, gs_out, upload_buffer_size)
-
-            patch_zip_blob_metadata(output_bucket, zip_loc, storage_client)
 
-        return True
+@contextmanager
+def exclusive_file_lock(lock_path: Path) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a lock file, shared across threads and processes, and
+    removes the lock file when done so lock files do not pile up next to the downloads.
+
+    A waiter may end up locking a lock file that the previous holder has already
+    removed, so after taking the lock it checks that the lock file is still the one at
+    ``lock_path``, and tries again if it is not.
+
+    :param lock_path: The path of the lock file
+    """
+    while True:
+        lock_file = lock_path.open("a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            is_current = os.fstat(lock_file.fileno()).st_ino == lock_path.stat().st_ino
+        except FileNotFoundError:
+            is_current = False
+        if is_current:
+            break
+        lock_file.close()
+
+    try:
+        yield
+    finally:
+        # removed while still held, so the next holder is always using a live lock file
+        lock_path.unlink(missing_ok=True)
+        lock_file.close()
+
+
+def download_sliced(blob: Blob, path: Path) -> None:
+    """
+    Downloads a large blob as several concurrent range requests.
+
+    The sliced download allocates the whole file up front, so it is written to a
+    temporary sibling file and moved into place when complete, a file at ``path`` with
+    the size of the blob is always complete.
+
+    :param blob: The blob to download
+    :param path: The local path to download the blob to
+    """
+    part_path = path.with_name(f"{path.name}.part")
+    try:
+        transfer_manager.download_chunks_concurrently(
+            blob,
+            str(part_path),
+            chunk_size=SLICED_DOWNLOAD_CHUNK_SIZE,
+            worker_type=transfer_manager.THREAD,
+            max_workers=min(
+                MAX_SLICES_PER_FILE,
+                math.ceil(blob.size / SLICED_DOWNLOAD_CHUNK_SIZE),
+            ),
+        )
+    except BaseException:
+        # a failed or corrupt download must not be picked up by a later attempt
+        part_path.unlink(missing_ok=True)
+        raise
+    part_path.replace(path)
 
 
 def estimate_remaining_time(
@@ -233,12 +410,15 @@ def estimate_remaining_time(
     :param total_file_count: The total number of files to be processed
     :param elapsed_time: The time since the process started.
     """
+    # nothing has been processed yet, so there is no rate to estimate from
+    if current_file_count <= 0:
+        return MAX_ACK_EXTENSION
     # calculate the estimated time remaining
     remaining_time = (elapsed_time / current_file_count) * (
         total_file_count - current_file_count
     )
 
-    return min(math.ceil(remaining_time * 1.5), 600)
+    return min(math.ceil(remaining_time * 1.5), MAX_ACK_EXTENSION)
 
 
 class ZipUploadError(Exception):
@@ -261,7 +441,7 @@ class ZipUploader:
         storage_client: StorageClient | None = None,
         input_bucket: str | None = None,
         output_bucket: str | None = None,
-        scratch_location: Path = Path("/tmp"),
+        scratch_location: Path | None = None,
         file_dl_location: Path = Path("/tmp/file_cache"),
         in_progress_cache: InProgressCache | None = None,
         requesters: list[Requester] | None = None,
@@ -278,12 +458,15 @@ class ZipUploader:
             file hash should be consistent to ensure that there are no namespace collisions.
             Suggested naming for this hash is the hash of the concatenation of the file names
             with some sort of delimiter (e.g. '_' or ',).
-        :param storage_client: A Google Cloud Storage client
+        :param storage_client: A Google Cloud Storage client, the files are downloaded
+            with it, so a larger connection pool is mounted on it (see
+            `mount_connection_pool`)
         :param input_bucket: The bucket where the files to be zipped are located
         :param output_bucket: The bucket where the final zip file will be uploaded
         :param notification_url: The URL to send a POST request with the notification
             ProtoBuf message (encoded as bytes) when the zip file is uploaded
-        :param scratch_location: The location where temporary files will be stored
+        :param scratch_location: Deprecated and ignored, the archive is written
+            directly to Google Cloud Storage
         :param file_dl_location: The location where files will be downloaded to
         :param in_progress_cache: An InProgressCache object to store the files that are
             being processed. This is used to prevent duplicate work from being processed.
@@ -296,6 +479,12 @@ class ZipUploader:
             parameter to the acknowledgement deadline of the subscription. By default, it is
             set to 600 seconds.
         """
+        if scratch_location is not None:
+            warnings.warn(
+                "scratch_location is no longer used and will be removed",
+                DeprecationWarning,
+                stacklevel=2,
+            )
         self.files = files
         self.file_hash = file_hash
 
@@ -320,12 +509,15 @@ class ZipUploader:
             self.output_bucket = storage_client.get_bucket(output_bucket)
 
         # the queue to communicate with the separate zip file creation process
-        self.queue: JoinableQueue[str | bool | BlobNotFoundError] = JoinableQueue()
+        self.queue: JoinableQueue[str | Literal[False] | BlobNotFoundError] = (
+            JoinableQueue(maxsize=MAX_QUEUED_FILES)
+        )
         self.message = message
+        # the metadata of the requested files, listed up front in `setup_processing`
+        self.blobs: dict[str, Blob | None] | None = None
 
         # the location to store the files that are being downloaded/unzipped
         self.file_dl_location = file_dl_location
-        self.tmp_dir_path = scratch_location / self.file_hash
 
         # the message from the PubSub pull subscription if that is the source of the
         # ZipUploader
@@ -351,20 +543,62 @@ class ZipUploader:
         logger.debug("%s Creating tmp directory", self.log_prefix)
         # the path to download the files to
         self.file_dl_location.mkdir(parents=True, exist_ok=True)
-        self.tmp_dir_path.mkdir(parents=True, exist_ok=True)
+        # the downloads go through the input bucket, and so the client that was passed in
+        mount_connection_pool(self.storage_client)
+        self.blobs = self.list_blobs()
+
+    def list_blobs(self) -> dict[str, Blob | None]:
+        """
+        Fetches the metadata of the requested files with one listing per directory that
+        at least `LIST_DIRECTORY_MIN_FILES` files are requested from, rather than one
+        metadata request per file. Each listing starts at the first requested file in
+        the directory and stops after the last one.
+
+        :return: A dictionary of the requested files in the listed directories to their
+            blobs, or to None if they do not exist in the bucket. Files in directories
+            that were not listed are not included, their metadata is fetched when they
+            are downloaded
+        """
+        directories: defaultdict[str, set[str]] = defaultdict(set)
+        for f in self.files:
+            directories[os.path.dirname(f)].add(f)  # noqa: PTH120
+        blobs: dict[str, Blob | None] = {}
+        for directory, files in directories.items():
+            if len(files) < LIST_DIRECTORY_MIN_FILES:
+                continue
+            logger.debug("%s Listing files in %s", self.log_prefix, directory)
+            blobs.update(dict.fromkeys(files))
+            last_file = max(files)
+            for blob in self.input_bucket.list_blobs(
+                prefix=f"{directory}/" if directory else None,
+                delimiter="/",
+                start_offset=min(files),
+                # the checksum is needed to verify sliced downloads
+                fields="items(name,size,generation,crc32c),nextPageToken",
+            ):
+                # the listing is in lexicographic order, so no later page is needed
+                if blob.name > last_file:
+                    break
+                if blob.name in files:
+                    blobs[blob.name] = blob
+        return blobs
 
     @threadpool
     def get_file(self, dl_object: str) -> Path | None:
         """
         Downloads a file from Google Cloud Storage to the local filesystem, returns early
-        if the file already exists, pauses if the file is currently being downloaded.
+        if the file already exists, waits if the file is currently being downloaded by
+        another thread or process.
 
         :param dl_object: The filename of the file to download (with path style
         gs://bucket/path/to/file)
         :return: The local path to the file
         """
         with tracer.start_as_current_span(dl_object):
-            blob = self.input_bucket.get_blob(dl_object)
+            if self.blobs is not None and dl_object in self.blobs:
+                blob = self.blobs[dl_object]
+            else:
+                blob = self.input_bucket.get_blob(dl_object)
             # parse the bucket and path from each file in the request
             logger.debug(
                 "%s Fetching file info for %s",
@@ -378,32 +612,22 @@ class ZipUploader:
             blob_size = blob.size
             path.parent.mkdir(parents=True, exist_ok=True)
 
-            # check if the file already exists
-            if path.exists():
-                logger.debug("%s File already exists at %s", self.log_prefix, path)
-                # does size of remote and local file match (the file may be currently
-                # downloading)
-                if path.stat().st_size < blob_size:
-                    logger.debug(
-                        "%s Waiting for other process to download %s",
-                        self.log_prefix,
-                        path,
-                    )
-
-                # if it does exist but is currently downloading, wait
-                while path.stat().st_size < blob_size:
-                    time.sleep(1)
-                logger.debug(
-                    "%s Other process finished downloading %s",
-                    self.log_prefix,
-                    path,
-                )
+            # hold an exclusive lock on the file while checking for and downloading it,
+            # if another thread or process is downloading it this blocks until it is
+            # done
+            with exclusive_file_lock(path.with_name(f"{path.name}.lock")):
+                # check if the file has already been downloaded
+                if path.exists() and path.stat().st_size == blob_size:
+                    logger.debug("%s File already exists at %s", self.log_prefix, path)
+                    return path
+
+                logger.debug("%s Downloading file to %s", self.log_prefix, path)
+                if blob_size > SLICED_DOWNLOAD_THRESHOLD:
+                    download_sliced(blob, path)
+                else:
+                    blob.download_to_filename(str(path))
                 return path
 
-            logger.debug("%s Downloading file to %s", self.log_prefix, path)
-            blob.download_to_filename(str(path))
-            return path
-
     def create_zip(self) -> None:
         """
         Create a process that will zip files. This process will watch a queue for
@@ -414,8 +638,12 @@ class ZipUploader:
 
         :return:
         """
-        # Asynchronously download each file in the request using a threadpool
-        futures: list[Future[Path | None]] = [self.get_file(file) for file in self.files]
+        # Asynchronously download the files in the request using a threadpool, keeping
+        # a window of at most MAX_CONCURRENT_DOWNLOADS submitted at once
+        files = iter(self.files)
+        pending: set[Future[Path | None]] = {
+            self.get_file(file) for file in islice(files, MAX_CONCURRENT_DOWNLOADS)
+        }
 
         # Create an atomic counter to track the number of files that have been processed
         atomic_counter = Value("i", 0, lock=True)
@@ -423,9 +651,7 @@ class ZipUploader:
         p = Process(
             target=add_to_zip,
             kwargs={
-                "tmp_dir": self.tmp_dir_path,
                 "zip_loc": self.full_output_path,
-                "output_bucket": self.output_bucket.name,
                 "file_path_prefix": self.file_dl_location,
                 "queue": self.queue,
                 "processed_counter": atomic_counter,
@@ -435,19 +661,25 @@ class ZipUploader:
 
         # as the files finish downloading, add them to the queue, ensuring that
         # time is not wasted waiting for files to download
-        for i, fut in enumerate(as_completed(futures)):
-            try:
-                tmp_file_path = fut.result()
-                tmp_file_path = str(tmp_file_path)
-                self.queue.put(tmp_file_path)
-                logger.debug(
-                    "%s Finished downloading file %s",
-                    self.log_prefix,
-                    tmp_file_path,
-                )
-                # if the file does not exist in GCS (which is when None is returned), skip it
-            except BlobNotFoundError as e:
-                self.queue.put(e)
+        i = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # top the window back up before handing off the finished files
+            pending.update(self.get_file(file) for file in islice(files, len(done)))
+            for fut in done:
+                try:
+                    tmp_file_path = fut.result()
+                    tmp_file_path = str(tmp_file_path)
+                    self.put_in_queue(tmp_file_path, p, i)
+                    logger.debug(
+                        "%s Finished downloading file %s",
+                        self.log_prefix,
+                        tmp_file_path,
+                    )
+                    # if the file does not exist in GCS, skip it
+                except BlobNotFoundError as e:
+                    self.put_in_queue(e, p, i)
+                i += 1
 
             # If this class has a message (e.g. we are pulling messages from the Pub/Sub
             # subscription rather than receiving `Push`-ed messages), check if the time
@@ -455,13 +687,16 @@ class ZipUploader:
             if self.message is not None:
                 self.check_message_deadline(i)
 
+        # sentinel to tell the zip process there are no more files
+        self.put_in_queue(END_OF_FILES, p, len(self.files))
+
         # wait for the add to zip process to finish
-        while True:
-            time.sleep(5)
+        while p.is_alive():
+            p.join(timeout=5)
             # while waiting for the zip process to finish log the number of files
             # and if running in Pull mode, extend the message deadline if needed
-            with atomic_counter.get_lock():
-                current_num_files = int(deepcopy(atomic_counter.value))
+            # reading a synchronized Value already takes its lock
+            current_num_files = atomic_counter.value
             logger.debug(
                 "%s Process counter is at %s / %s",
                 self.log_prefix,
@@ -470,12 +705,36 @@ class ZipUploader:
             )
             if self.message is not None:
                 self.check_message_deadline(current_num_files)
-            # break if the queue is empty (process is about to finish)
-            if self.queue.empty():
-                break
 
         self.cleanup_create_zip(p)
 
+    def put_in_queue(
+        self,
+        item: str | Literal[False] | BlobNotFoundError,
+        proc: Process,
+        current_num_files: int,
+    ) -> None:
+        """
+        Puts an item in the queue for the zip file creation process, blocking while the
+        queue is full. While blocked, the message deadline is kept extended (if there is
+        a message) and the zip process is checked to still be running.
+
+        :param item: The item to put in the queue
+        :param proc: The zip file creation process consuming the queue
+        :param current_num_files: The number of files that have been downloaded/processed
+        """
+        while True:
+            try:
+                self.queue.put(item, timeout=5)
+            except Full:
+                if not proc.is_alive():
+                    msg = "Zip file creation process exited unexpectedly"
+                    raise ZipUploadError(msg) from None
+                if self.message is not None:
+                    self.check_message_deadline(current_num_files)
+            else:
+                return
+
     def check_message_deadline(self, current_num_files: int) -> None:
         """
         Checks if the message is about to expire, and modifies the message if it is.
@@ -509,13 +768,17 @@ class ZipUploader:
 
     def cleanup_create_zip(self, proc: Process) -> None:
         """
-        Closes/joins the queue and zip file creation process.
+        Joins the zip file creation process and closes the queue.
         """
-        self.queue.put(obj=False)
-        self.queue.join()
+        proc.join()
+        if proc.exitcode != 0:
+            # the process did not consume the whole queue, don't wait on flushing it
+            self.queue.cancel_join_thread()
         self.queue.close()
         self.queue.join_thread()
-        proc.join()
+        if proc.exitcode != 0:
+            msg = f"Zip file creation process exited with code {proc.exitcode}"
+            raise ZipUploadError(msg)
 
     def check_zip_exists_in_bucket(self) -> None:
         """
@@ -556,9 +819,8 @@ class ZipUploader:
         Sends a notification to the user.
         """
         if self.in_progress_cache is not None:
-            self.requesters = list(
-                self.in_progress_cache.get_requesters(self.file_hash),
-            )
+            # a copy, as requesters may be removed while the notifications are sent
+            self.requesters = self.in_progress_cache.get_requesters(self.file_hash)
         logger.debug("%s Sending notification to %s", self.log_prefix, self.requesters)
 
         if len(self.requesters) > 0:
@@ -598,6 +860,4 @@ class ZipUploader:
                 logger.info("%s REQUEST TIMER: %s seconds", self.log_prefix, t2 - t1)
             except Exception as e:
                 logger.exception("Exception occurred while processing files.")
-                if self.tmp_dir_path:
-                    shutil.rmtree(self.tmp_dir_path)
                 raise ZipUploadError from e
@@ -3,9 +3,11 @@
 Contains a cache class for the zipper and messaging features.
 """
 
-import time
-from collections import defaultdict
+from collections.abc import Iterable
 from multiprocessing import Array, Value
+# bound at import so the polling hot path does a single global lookup; the monotonic
+# clock is system-wide, so values written by one process can be compared in another
+from time import monotonic as _time
 
 from motrpac_backend_utils.requester import Requester
 
@@ -13,30 +15,39 @@ from motrpac_backend_utils.requester import Requester
 class LastMessage:
     """
     A utility class for tracking the last message sent.
+
+    The stored time is read from the monotonic clock, so it is not a wall-clock epoch
+    and is only meaningful when compared with another reading of the same clock.
+
+    Polling loops should compare `diff` directly, e.g. `last_message.diff > 30`, the
+    comparison operators are kept for compatibility but add a method call per check.
     """
 
+    __slots__ = ("diff", "time")
+
     def __init__(self, atomic_last_message_time: type[Value]) -> None:
         """
         Creates a new instance of the LastMessage class.
 
         :param atomic_last_message_time: The atomic value to store the time the last
-            message was received
+            message was received, as a reading of the monotonic clock (`time.monotonic`)
+            in seconds, not an epoch
         """
         self.time = atomic_last_message_time
-        self.time.value = int(time.time())
+        self.time.value = int(_time())
         self.diff = 0
 
     def reset(self) -> None:
         """
         Resets the time the last message was received to the current time.
         """
-        self.time.value = int(time.time())
+        self.time.value = int(_time())
 
     def update_diff(self) -> int:
         """
         Updates the difference between the current time and the last message time.
         """
-        self.diff = int(time.time()) - self.time.value
+        self.diff = int(_time()) - self.time.value
         return self.diff
 
     def __lt__(self, other: int) -> bool:
@@ -67,6 +78,14 @@ class InProgressCache:
     A utility class for tracking which files are being processed.
     """
 
+    __slots__ = (
+        "_in_progress",
+        "_published_in_progress",
+        "atomic_in_progress",
+        "atomic_processing_hashes",
+        "cache",
+    )
+
     def __init__(
         self,
         atomic_in_progress: type[Value],
@@ -75,9 +94,16 @@ class InProgressCache:
         """
         Creates a new instance of the InProgressCache.
         """
-        self.cache: defaultdict[str, RequesterSet] = defaultdict()
+        self.cache: dict[str, RequesterSet] = {}
         self.atomic_in_progress: Value = atomic_in_progress
         self.atomic_processing_hashes = atomic_processing_hashes
+        # the hashes of the files still in progress, mapped to their encoded form so they
+        # are only encoded once. A dict is used as an insertion-ordered set so the shared
+        # array lists them in request order
+        self._in_progress: dict[str, bytes] = {}
+        # the last value written to atomic_in_progress, kept locally so the shared
+        # value (and its lock) is only touched when the flag changes
+        self._published_in_progress: bool | None = None
 
     def add_requester(self, file_hash: str, requester: Requester) -> None:
         """
@@ -87,27 +113,47 @@ class InProgressCache:
         :param file_hash: The file to add
         :param requester: The requester of the file
         """
-        if file_hash not in self.cache:
+        requester_set = self.cache.get(file_hash)
+        if requester_set is None:
             self.cache[file_hash] = RequesterSet(requester)
         else:
-            self.cache[file_hash].add_requester(requester)
-        self.update_progress()
+            requester_set.add_requester(requester)
+        self._track(file_hash)
 
     def finish_file(self, file_hash: str) -> None:
         """
         Signals the fileHash has been processed
         :param file_hash: The fileHash to signal as completed processing.
         """
-        self.cache[file_hash].finish()
-        self.update_progress()
+        requester_set = self.cache.get(file_hash)
+        if requester_set is None:
+            return
+        requester_set.finish()
+        self._track(file_hash)
 
     def get_requesters(self, file_hash: str) -> list[Requester]:
         """
-        Gets the requesters of a file.
+        Gets the requesters of a file, as a copy which is safe to hold on to while
+        requesters are added or removed.
 
         :param file_hash: The set of files to get the requesters of
         """
-        return self.cache[file_hash].get_requesters()
+        requester_set = self.cache.get(file_hash)
+        if requester_set is None:
+            return []
+        return requester_set.get_requesters()
+
+    def iter_requesters(self, file_hash: str) -> Iterable[Requester]:
+        """
+        Gets a read-only view of the requesters of a file, without copying them. The
+        view must not be iterated over while requesters are added or removed.
+
+        :param file_hash: The set of files to get the requesters of
+        """
+        requester_set = self.cache.get(file_hash)
+        if requester_set is None:
+            return ()
+        return requester_set.iter_requesters()
 
     def remove_requester(self, file_hash: str, requester: Requester) -> None:
         """
@@ -117,10 +163,11 @@ class InProgressCache:
         :param file_hash: The fileHash to remove the requesters of
         :param requester: The requester to remove
         """
-        requester_set = self.cache[file_hash]
-        if requester_set is not None:
-            requester_set.remove_requester(requester)
-        self.update_progress()
+        requester_set = self.cache.get(file_hash)
+        if requester_set is None:
+            return
+        requester_set.remove_requester(requester)
+        self._track(file_hash)
 
     def is_processed(self, file_hash: str) -> bool:
         """
@@ -138,27 +185,53 @@ class InProgressCache:
         :param file_hash: The file hash to check
         :return: Whether the file processing is in progress
         """
-        return self.is_processed(file_hash) and self.cache[file_hash].is_in_progress()
+        return file_hash in self._in_progress
+
+    def _track(self, file_hash: str) -> None:
+        """
+        Updates the in-progress set for a single file hash, and publishes the atomic
+        values if the membership of the set changed.
+
+        :param file_hash: The file hash that was changed
+        """
+        requester_set = self.cache.get(file_hash)
+        is_in_progress = requester_set is not None and requester_set.is_in_progress()
+        if is_in_progress == (file_hash in self._in_progress):
+            return
+        if is_in_progress:
+            self._in_progress[file_hash] = file_hash.encode()
+        else:
+            del self._in_progress[file_hash]
+        self._publish_progress()
 
     def update_progress(self) -> None:
         """
         Gets whether any files are being processed, and updates the atomic values, which
         are shared across processes and used to determine if the program should continue
-        to run.
+        to run. The in-progress set is rebuilt from the whole cache, so changes made
+        directly on a `RequesterSet` (e.g. `resume` or `finish`) are picked up.
         """
-        is_in_progress = False
-        tmp_in_progress = []
+        encoded = self._in_progress
+        self._in_progress = {
+            file_hash: encoded.get(file_hash) or file_hash.encode()
+            for file_hash, requester_set in self.cache.items()
+            if requester_set.is_in_progress()
+        }
+        self._publish_progress()
 
-        for f_hash, cache in self.cache.items():
-            if cache.is_in_progress():
-                is_in_progress = True
-                tmp_in_progress.append(f_hash)
+    def _publish_progress(self) -> None:
+        """
+        Updates the atomic values from the in-progress set.
+        """
+        is_in_progress = bool(self._in_progress)
 
-        # Set the atomic boolean
-        self.atomic_in_progress.value = int(is_in_progress)
+        # Set the atomic boolean, skipping the locked write if it has not changed
+        if is_in_progress != self._published_in_progress:
+            self.atomic_in_progress.value = int(is_in_progress)
+            self._published_in_progress = is_in_progress
 
         # Set the atomic array
-        self.atomic_processing_hashes.value = (",".join(tmp_in_progress)).encode()
+        self.atomic_processing_hashes.value = b",".join(self._in_progress.values())
 
 
 class RequesterSet:
@@ -166,7 +239,11 @@ class RequesterSet:
     A utility class for tracking the requesters of the files being processed.
     """
 
-    requesters: set[Requester]
+    __slots__ = ("finished", "requesters")
+
+    # a dict is used as an insertion-ordered set, so requesters are notified in the
+    # order they made the request
+    requesters: dict[Requester, None]
     finished: bool
 
     def __init__(self, new_requester: Requester) -> None:
@@ -176,8 +253,7 @@ class RequesterSet:
         :param new_requester: The requester of the file
         """
         self.finished = False
-        self.requesters = set()
-        self.requesters.add(new_requester)
+        self.requesters = {new_requester: None}
 
     def get_requesters(self) -> list[Requester]:
         """
@@ -187,13 +263,21 @@ class RequesterSet:
         """
         return list(self.requesters)
 
+    def iter_requesters(self) -> Iterable[Requester]:
+        """
+        Gets a read-only view of the requesters of the file, without copying them.
+
+        :return: The requesters
+        """
+        return self.requesters.keys()
+
     def add_requester(self, requester: Requester) -> None:
         """
         Adds a requester to the set.
 
         :param requester: The requester to add
         """
-        self.requesters.add(requester)
+        self.requesters[requester] = None
 
     def remove_requester(self, requester: Requester) -> None:
         """
@@ -201,7 +285,7 @@ class RequesterSet:
 
         :param requester: The requester to remove
         """
-        self.requesters.remove(requester)
+        del self.requesters[requester]
         if len(self.requesters) == 0:
             self.finished = True
 
@@ -3,6 +3,9 @@
 from collections import defaultdict
 from typing import Any
 
+# appended to a manifest entry when the file could not be added to the archive
+MANIFEST_ERROR_SUFFIX = " [Error: unable to retrieve file]"
+
 
 def nested_dict() -> defaultdict:
     """
@@ -28,12 +31,22 @@ def get_path_dict(paths: list[str]) -> dict:
     """
     new_path_dict = nested_dict()
     for path in paths:
-        if "Error: " in path:
+        # skip the files that could not be added to the archive
+        if path.endswith(MANIFEST_ERROR_SUFFIX):
             continue
-        parts = path.split("/")
-        if parts:
-            marcher = new_path_dict
-            for key in parts[:-1]:
-                marcher = marcher[key]
-            marcher.setdefault("contents", []).append(parts[-1])
+        add_to_path_dict(new_path_dict, path)
     return default_to_regular(new_path_dict)
+
+
+def add_to_path_dict(path_dict: defaultdict, path: str) -> None:
+    """
+    Adds a single path to a nested dictionary of paths created with `nested_dict`.
+
+    :param path_dict: The nested dictionary to add the path to
+    :param path: The path to add
+    """
+    parts = path.split("/")
+    marcher = path_dict
+    for key in parts[:-1]:
+        marcher = marcher[key]
+    marcher.setdefault("contents", []).append(parts[-1])
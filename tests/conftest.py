@@ -0,0 +1,77 @@
+#  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+
+from collections.abc import Iterator
+
+import pytest
+from google.protobuf.internal import api_implementation
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import ProxyTracerProvider
+
+from motrpac_backend_utils import threadpool
+
+
+def pytest_sessionstart(session: pytest.Session) -> None:  # noqa: ARG001
+    """
+    Fails fast if protobuf is using its pure-Python backend, which the package warns
+    about at import, so the message tests run against the backend used in production.
+    """
+    if api_implementation.Type() == "python":
+        msg = (
+            "protobuf is using the pure-Python backend, install a protobuf build with "
+            "the upb backend or unset PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"
+        )
+        raise pytest.UsageError(msg)
+
+
+@pytest.fixture(scope="session")
+def span_exporter() -> InMemorySpanExporter:
+    """
+    The exporter the test spans are sent to, kept in memory so tests can inspect them
+    with `get_finished_spans`.
+    """
+    return InMemorySpanExporter()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tracer_provider(span_exporter: InMemorySpanExporter) -> Iterator[TracerProvider]:
+    """
+    Sets up the global tracer provider once for the test session, and shuts it down at
+    the end of the session. Spans are exported as they end, exporting to memory is cheap
+    enough that batching them on a worker thread is not needed.
+    """
+    # the global tracer provider can only be set once, reuse one that is already set
+    # (e.g. by a plugin) rather than building one that would be ignored
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, ProxyTracerProvider):
+        provider = TracerProvider()
+        trace.set_tracer_provider(provider)
+    provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+    yield provider
+    provider.shutdown()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _reset_default_threadpool() -> Iterator[None]:
+    """
+    Shuts down the default threadpool after each test module, so its idle worker threads
+    do not outlive the tests that used them. It is created again on first use.
+    """
+    yield
+    pool = threadpool._default_pool  # noqa: SLF001
+    if pool is not None:
+        pool.shutdown(wait=True)
+        threadpool._default_pool = None  # noqa: SLF001
+
+
+@pytest.fixture(autouse=True)
+def _clean_prod_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Unsets PRODUCTION_DEPLOYMENT for every test, so a value set in the environment the
+    tests run in (e.g. CI) cannot switch the code under test to its production paths.
+    """
+    monkeypatch.delenv("PRODUCTION_DEPLOYMENT", raising=False)
@@ -0,0 +1,114 @@
+#  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+
+import unittest
+from multiprocessing import Array, Value
+from unittest.mock import patch
+
+from motrpac_backend_utils.requester import Requester
+from motrpac_backend_utils.zipper.cache import InProgressCache, LastMessage
+
+
+class TestInProgressCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.atomic_in_progress = Value("i", 0)
+        self.atomic_processing_hashes = Array("c", 1024)
+        self.cache = InProgressCache(
+            self.atomic_in_progress,
+            self.atomic_processing_hashes,
+        )
+        self.requester = Requester(
+            name="John Doe",
+            email="johndoe@example.com",
+            id="1234567890",
+        )
+
+    def test_add_and_finish_file(self) -> None:
+        self.cache.add_requester("hash1", self.requester)
+        self.cache.add_requester("hash2", self.requester)
+
+        assert self.atomic_in_progress.value == 1
+        assert self.atomic_processing_hashes.value == b"hash1,hash2"
+        assert self.cache.file_is_in_progress("hash1")
+
+        self.cache.finish_file("hash1")
+        assert self.atomic_in_progress.value == 1
+        assert self.atomic_processing_hashes.value == b"hash2"
+
+        self.cache.finish_file("hash2")
+        assert self.atomic_in_progress.value == 0
+        assert self.atomic_processing_hashes.value == b""
+        assert self.cache.is_processed("hash1")
+        assert not self.cache.file_is_in_progress("hash1")
+
+    def test_remove_last_requester_finishes_file(self) -> None:
+        other = Requester(name="Jane Doe", email="janedoe@example.com", id=None)
+        self.cache.add_requester("hash1", self.requester)
+        self.cache.add_requester("hash1", other)
+
+        assert self.cache.get_requesters("hash1") == [self.requester, other]
+        assert list(self.cache.iter_requesters("hash1")) == [self.requester, other]
+
+        self.cache.remove_requester("hash1", self.requester)
+        assert self.cache.file_is_in_progress("hash1")
+
+        self.cache.remove_requester("hash1", other)
+        assert not self.cache.file_is_in_progress("hash1")
+        assert self.atomic_in_progress.value == 0
+
+    def test_shared_array_only_written_on_membership_change(self) -> None:
+        self.cache.add_requester("hash1", self.requester)
+        self.atomic_processing_hashes.value = b"sentinel"
+
+        other = Requester(name="Jane Doe", email="janedoe@example.com", id=None)
+        self.cache.add_requester("hash1", other)
+        assert self.atomic_processing_hashes.value == b"sentinel"
+
+        self.cache.finish_file("hash1")
+        assert self.atomic_processing_hashes.value == b""
+
+    def test_update_progress_resyncs_from_cache(self) -> None:
+        self.cache.add_requester("hash1", self.requester)
+        self.cache.add_requester("hash2", self.requester)
+
+        # changed directly, bypassing the InProgressCache
+        self.cache.cache["hash1"].finish()
+        self.cache.update_progress()
+        assert not self.cache.file_is_in_progress("hash1")
+        assert self.atomic_processing_hashes.value == b"hash2"
+
+        self.cache.cache["hash1"].resume()
+        self.cache.cache["hash2"].finish()
+        self.cache.update_progress()
+        assert self.cache.file_is_in_progress("hash1")
+        assert self.atomic_processing_hashes.value == b"hash1"
+
+        self.cache.cache["hash1"].finish()
+        self.cache.update_progress()
+        assert self.atomic_in_progress.value == 0
+        assert self.atomic_processing_hashes.value == b""
+
+    def test_unknown_hash_is_ignored(self) -> None:
+        self.cache.finish_file("missing")
+        self.cache.remove_requester("missing", self.requester)
+
+        assert self.cache.get_requesters("missing") == []
+        assert tuple(self.cache.iter_requesters("missing")) == ()
+        assert not self.cache.is_processed("missing")
+
+
+class TestLastMessage(unittest.TestCase):
+    def test_diff_uses_monotonic_clock(self) -> None:
+        atomic_time = Value("i", 0)
+        with patch("motrpac_backend_utils.zipper.cache._time", return_value=100.0):
+            last_message = LastMessage(atomic_time)
+        assert atomic_time.value == 100
+
+        with patch("motrpac_backend_utils.zipper.cache._time", return_value=130.0):
+            assert last_message.update_diff() == 30
+            assert last_message > 29
+            last_message.reset()
+        assert atomic_time.value == 130
+
+
+if __name__ == "__main__":
+    unittest.main()
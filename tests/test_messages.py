@@ -1,6 +1,7 @@
 #  Copyright (c) 2023. Mihir Samdarshi/MoTrPAC Bioinformatics Center
 
 import unittest
+from functools import cache
 from unittest import mock
 from unittest.mock import MagicMock
 
@@ -9,26 +10,39 @@ from google.api_core.exceptions import GoogleAPICallError
 from google.cloud.pubsub_v1 import PublisherClient
 from google.cloud.pubsub_v1.publisher.futures import Future
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import (
-    BatchSpanProcessor,
-    ConsoleSpanExporter,
-)
 
 from motrpac_backend_utils.messages import (
+    PUBLISH_BATCH_SETTINGS,
+    _get_default_publisher_client,
     publish_file_download_message,
     decode_file_download_message,
+    send_notification_message,
 )
-from motrpac_backend_utils.proto import FileDownloadMessage
+from motrpac_backend_utils.proto import FileDownloadMessage, UserNotificationMessage
 from motrpac_backend_utils.requester import Requester
 
-tracer_provider = TracerProvider()
-trace.set_tracer_provider(tracer_provider)
-
-trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+# the tracer provider is set up by the session fixture in conftest.py
 tracer = trace.get_tracer(__name__)
 
 
+# the encoded messages are cached, so each is only serialized once per test run
+@cache
+def encode_file_download_message(
+    files: tuple[str, ...],
+    name: str | None = None,
+    email: str | None = None,
+    user_id: str | None = None,
+) -> bytes:
+    message = FileDownloadMessage(files=files)
+    if name is not None:
+        message.requester.CopyFrom(
+            Requester(name=name, email=email, id=user_id).to_proto(
+                FileDownloadMessage.Requester,
+            ),
+        )
+    return message.SerializeToString()
+
+
 class TestDecodeFileDownloadMessage(unittest.TestCase):
     def test_decode_file_download_message(self) -> None:
         # Arrange
@@ -36,14 +50,9 @@ class TestDecodeFileDownloadMessage(unittest.TestCase):
         name = "John Doe"
         user_id = "1234567890"
         email = "johndoe@example.com"
-        message = FileDownloadMessage()
-        message.files.extend(files)
-        message.requester.CopyFrom(
-            Requester(name=name, email=email, id=user_id).to_proto(
-                FileDownloadMessage.Requester,
-            ),
+        encoded_message = encode_file_download_message(
+            tuple(files), name, email, user_id,
         )
-        encoded_message = message.SerializeToString()
 
         # Act
         decoded_files, requester = decode_file_download_message(encoded_message)
@@ -53,6 +62,13 @@ class TestDecodeFileDownloadMessage(unittest.TestCase):
         assert requester.name == name
         assert requester.email == email
 
+    def test_decode_file_download_message_bytes_like(self) -> None:
+        encoded_message = encode_file_download_message(("file1.txt",))
+
+        for message in (bytearray(encoded_message), memoryview(encoded_message)):
+            decoded_files, _ = decode_file_download_message(message)
+            assert decoded_files == ["file1.txt"]
+
     def test_decode_file_download_message_invalid_message(self) -> None:
         # Arrange
         invalid_message = b"invalid_message"
@@ -63,9 +79,16 @@ class TestDecodeFileDownloadMessage(unittest.TestCase):
 
 
 class TestPublishFileDownloadMessage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        # building a spec'd mock inspects the whole class, so they are built once and
+        # reset between tests
+        cls.mock_client = MagicMock(spec=PublisherClient)
+        cls.mock_future = MagicMock(spec=Future)
+
     def setUp(self) -> None:
-        self.mock_client = MagicMock(spec=PublisherClient)
-        self.mock_future = MagicMock(spec=Future)
+        self.mock_client.reset_mock(side_effect=True)
+        self.mock_future.reset_mock()
         self.mock_client.publish.return_value = self.mock_future
 
     def test_publish_file_download_message_success(self) -> None:
@@ -80,7 +103,7 @@ class TestPublishFileDownloadMessage(unittest.TestCase):
             "test_publish_file_download_message_success",
         ) as span:
             span.set_attribute("printed_string", "hello")
-            publish_file_download_message(
+            future = publish_file_download_message(
                 name,
                 user_id,
                 email,
@@ -90,12 +113,20 @@ class TestPublishFileDownloadMessage(unittest.TestCase):
             )
 
         # Assert
+        assert future is self.mock_future
         self.mock_client.publish.assert_called_once_with(
             topic_id,
             mock.ANY,
-            googclient_OpenTelemetrySpanContext=mock.ANY,
+            traceparent=mock.ANY,
         )
-        self.mock_future.result.assert_called_once()
+        # the propagated context belongs to the test span's trace
+        traceparent = self.mock_client.publish.call_args.kwargs["traceparent"]
+        assert traceparent.split("-")[1] == format(
+            span.get_span_context().trace_id, "032x",
+        )
+        # the publish is waited on, so the result is not also logged by a callback
+        self.mock_future.result.assert_called_once_with()
+        self.mock_future.add_done_callback.assert_not_called()
 
     def test_publish_file_download_message_failure(self) -> None:
         # Arrange
@@ -122,6 +153,68 @@ class TestPublishFileDownloadMessage(unittest.TestCase):
                 self.mock_client,
             )
 
+    def test_publish_file_download_message_no_await_result(self) -> None:
+        future = publish_file_download_message(
+            "John Doe",
+            None,
+            "johndoe@example.com",
+            ["file1.txt"],
+            "my-topic",
+            self.mock_client,
+            await_result=False,
+        )
+
+        # the publish is not waited on, the result is logged by a callback
+        assert future is self.mock_future
+        self.mock_future.result.assert_not_called()
+        self.mock_future.add_done_callback.assert_called_once()
+
+    def test_publish_file_download_message_default_client(self) -> None:
+        _get_default_publisher_client.cache_clear()
+        self.addCleanup(_get_default_publisher_client.cache_clear)
+        with mock.patch(
+            "motrpac_backend_utils.messages.PublisherClient",
+            return_value=self.mock_client,
+        ) as mock_publisher_client:
+            for _ in range(2):
+                publish_file_download_message(
+                    "John Doe", None, "johndoe@example.com", ["file1.txt"], "my-topic",
+                )
+
+        mock_publisher_client.assert_called_once_with(
+            batch_settings=PUBLISH_BATCH_SETTINGS,
+        )
+        assert self.mock_client.publish.call_count == 2
+
+
+class TestSendNotificationMessage(unittest.TestCase):
+    def test_send_notification_message_reuses_session(self) -> None:
+        url = "https://example.com/notification"
+        with mock.patch(
+            "motrpac_backend_utils.messages.get_authorized_session",
+        ) as mock_get_session, mock.patch.dict(
+            "motrpac_backend_utils.messages._notification_sessions",
+            clear=True,
+        ):
+            for _ in range(2):
+                send_notification_message(
+                    "John Doe",
+                    "1234567890",
+                    "johndoe@example.com",
+                    "hash123.zip",
+                    ["file1.txt"],
+                    url,
+                )
+
+        mock_get_session.assert_called_once_with(url)
+        mock_post = mock_get_session.return_value.post
+        assert mock_post.call_count == 2
+        message = UserNotificationMessage.FromString(mock_post.call_args.kwargs["data"])
+        assert message.requester.name == "John Doe"
+        assert message.requester.id == "1234567890"
+        assert message.zipfile == "hash123.zip"
+        assert list(message.files) == ["file1.txt"]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,43 @@
+#  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+
+import unittest
+
+from motrpac_backend_utils.proto import FileDownloadMessage
+from motrpac_backend_utils.requester import Requester
+
+
+class TestRequester(unittest.TestCase):
+    def test_requester_equality_and_hash(self) -> None:
+        requester = Requester(name="John Doe", email="johndoe@example.com", id="123")
+        same = Requester(name="John Doe", email="johndoe@example.com", id="123")
+
+        assert requester == same
+        assert len({requester, same}) == 1
+        # comparing against another type is not an error
+        assert requester != ("John Doe", "johndoe@example.com", "123")
+        assert ("John Doe", "johndoe@example.com", "123") != requester  # noqa: SIM300
+        assert requester != Requester(name="John Doe", email="johndoe@example.com")
+
+    def test_requester_is_a_named_tuple(self) -> None:
+        requester = Requester("John Doe", "johndoe@example.com", "123")
+
+        name, email, user_id = requester
+        assert (name, email, user_id) == ("John Doe", "johndoe@example.com", "123")
+        assert requester[0] == "John Doe"
+        assert requester._asdict()["email"] == "johndoe@example.com"
+        assert requester._replace(id=None).id is None
+
+    def test_requester_proto_round_trip(self) -> None:
+        requester = Requester(name="John Doe", email="johndoe@example.com")
+        proto = requester.to_proto(FileDownloadMessage.Requester)
+
+        assert Requester.from_proto(proto) == Requester(
+            name="John Doe",
+            email="johndoe@example.com",
+            id="",
+        )
+        assert repr(requester) == "John Doe (None) <johndoe@example.com>"
+
+
+if __name__ == "__main__":
+    unittest.main()
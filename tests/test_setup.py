@@ -0,0 +1,191 @@
+#  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+
+import atexit
+import io
+import json
+import logging
+import unittest
+from logging.handlers import MemoryHandler, QueueHandler
+from unittest import mock
+
+from google.cloud.logging_v2.handlers import StructuredLogHandler
+from opentelemetry import trace
+from opentelemetry.trace import NonRecordingSpan, SpanContext
+
+from motrpac_backend_utils.setup import (
+    TraceIdInjectionFilter,
+    _get_cloud_logging_handler,
+    setup_logging_and_tracing,
+)
+
+
+class TestTraceIdInjectionFilter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", (), None)
+
+    def test_filter_adds_trace_info(self) -> None:
+        span = NonRecordingSpan(SpanContext(trace_id=0xABC, span_id=0x12, is_remote=False))
+        with trace.use_span(span):
+            assert TraceIdInjectionFilter().filter(self.record)
+
+        assert self.record.trace == f"{0xABC:032x}"
+        assert self.record.span == f"{0x12:016x}"
+
+    def test_filter_skips_invalid_span(self) -> None:
+        assert TraceIdInjectionFilter().filter(self.record)
+        assert not hasattr(self.record, "trace")
+
+
+class TestSetupLoggingAndTracing(unittest.TestCase):
+    def test_tracing_is_set_up_once(self) -> None:
+        with mock.patch.multiple(
+            "motrpac_backend_utils.setup",
+            _tracer_provider=None,
+            _prod_tracing_initialized=False,
+        ), mock.patch(
+            "motrpac_backend_utils.setup.trace.set_tracer_provider",
+        ) as mock_set_tracer_provider:
+            setup_logging_and_tracing(is_prod=False)
+            setup_logging_and_tracing(is_prod=False)
+
+        mock_set_tracer_provider.assert_called_once()
+
+    def test_prod_tracing_is_added_after_dev_setup(self) -> None:
+        with mock.patch.multiple(
+            "motrpac_backend_utils.setup",
+            _tracer_provider=None,
+            _prod_tracing_initialized=False,
+            _get_cloud_logging_handler=mock.DEFAULT,
+            set_global_textmap=mock.DEFAULT,
+            BatchSpanProcessor=mock.DEFAULT,
+        ) as setup_mocks, mock.patch(
+            "motrpac_backend_utils.setup.trace.set_tracer_provider",
+        ) as mock_set_tracer_provider, mock.patch(
+            "google.cloud.logging_v2.handlers.setup_logging",
+        ), mock.patch(
+            "opentelemetry.exporter.cloud_trace.CloudTraceSpanExporter",
+        ), mock.patch(
+            "opentelemetry.instrumentation.requests.RequestsInstrumentor",
+        ), mock.patch(
+            "opentelemetry.instrumentation.urllib3.URLLib3Instrumentor",
+        ):
+            setup_logging_and_tracing(is_prod=False)
+            setup_logging_and_tracing(is_prod=True)
+            with self.assertLogs("motrpac_backend_utils.setup", logging.WARNING):
+                setup_logging_and_tracing(is_prod=True, span_batch_size=128)
+
+        mock_set_tracer_provider.assert_called_once()
+        setup_mocks["BatchSpanProcessor"].assert_called_once()
+        setup_mocks["set_global_textmap"].assert_called_once()
+
+    def test_cloud_logging_handler_is_reused(self) -> None:
+        _get_cloud_logging_handler.cache_clear()
+        self.addCleanup(_get_cloud_logging_handler.cache_clear)
+        with mock.patch.multiple(
+            "motrpac_backend_utils.setup",
+            _tracer_provider=mock.DEFAULT,
+            _prod_tracing_initialized=True,
+        ), mock.patch(
+            "google.cloud.logging.Client",
+        ) as mock_client, mock.patch(
+            "google.cloud.logging_v2.handlers.setup_logging",
+        ) as mock_setup_logging:
+            mock_client.return_value.get_default_handler.return_value = (
+                logging.NullHandler()
+            )
+            setup_logging_and_tracing(is_prod=True)
+            setup_logging_and_tracing(is_prod=True)
+
+        mock_client.assert_called_once()
+        handlers = [c.args[0] for c in mock_setup_logging.call_args_list]
+        assert handlers[0] is handlers[1]
+        assert isinstance(handlers[0].filters[0], TraceIdInjectionFilter)
+
+    def get_structured_handler(self, stream: io.StringIO) -> QueueHandler:
+        _get_cloud_logging_handler.cache_clear()
+        self.addCleanup(_get_cloud_logging_handler.cache_clear)
+        with mock.patch("google.cloud.logging.Client") as mock_client:
+            mock_client.return_value.get_default_handler.return_value = (
+                StructuredLogHandler(stream=stream, project_id="test-project")
+            )
+            handler = _get_cloud_logging_handler()
+        # stop the background thread now rather than at exit
+        atexit.unregister(handler.listener.stop)
+        self.addCleanup(handler.listener.stop)
+        return handler
+
+    def test_structured_logs_are_written_off_thread(self) -> None:
+        stream = io.StringIO()
+        handler = self.get_structured_handler(stream)
+
+        span = NonRecordingSpan(SpanContext(trace_id=0xABC, span_id=0x12, is_remote=False))
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "hi %s", ("x",), None)
+        with trace.use_span(span):
+            handler.handle(record)
+        handler.queue.join()
+
+        assert isinstance(handler, QueueHandler)
+        entry = json.loads(stream.getvalue())
+        assert entry["message"] == "hi x"
+        assert entry["logging.googleapis.com/spanId"] == f"{0x12:016x}"
+
+    def test_structured_dict_logs_keep_their_fields(self) -> None:
+        stream = io.StringIO()
+        handler = self.get_structured_handler(stream)
+
+        message = {"message": "hi", "fileHash": "hash123"}
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, message, (), None)
+        handler.handle(record)
+        handler.queue.join()
+
+        entry = json.loads(stream.getvalue())
+        assert entry["message"] == "hi"
+        assert entry["fileHash"] == "hash123"
+
+    def test_dev_logs_can_be_buffered(self) -> None:
+        root = logging.getLogger()
+        with mock.patch.object(root, "handlers", []), mock.patch(
+            "motrpac_backend_utils.setup._tracer_provider",
+        ):
+            setup_logging_and_tracing(is_prod=False, dev_log_buffer_size=16)
+            (handler,) = root.handlers
+
+        assert isinstance(handler, MemoryHandler)
+        assert handler.capacity == 16
+        assert handler.flushLevel == logging.WARNING
+
+    def test_span_export_settings(self) -> None:
+        with mock.patch.multiple(
+            "motrpac_backend_utils.setup",
+            _tracer_provider=None,
+            _prod_tracing_initialized=False,
+            _get_cloud_logging_handler=mock.DEFAULT,
+            set_global_textmap=mock.DEFAULT,
+            BatchSpanProcessor=mock.DEFAULT,
+        ) as setup_mocks, mock.patch(
+            "motrpac_backend_utils.setup.trace.set_tracer_provider",
+        ), mock.patch(
+            "google.cloud.logging_v2.handlers.setup_logging",
+        ), mock.patch(
+            "opentelemetry.exporter.cloud_trace.CloudTraceSpanExporter",
+        ), mock.patch(
+            "opentelemetry.instrumentation.requests.RequestsInstrumentor",
+        ), mock.patch(
+            "opentelemetry.instrumentation.urllib3.URLLib3Instrumentor",
+        ), mock.patch.dict(
+            "os.environ",
+            {"OTEL_BSP_SCHEDULE_DELAY": "2000"},
+        ):
+            setup_logging_and_tracing(is_prod=True, span_batch_size=128)
+
+        setup_mocks["BatchSpanProcessor"].assert_called_once_with(
+            mock.ANY,
+            max_queue_size=4096,
+            schedule_delay_millis=None,
+            max_export_batch_size=128,
+            export_timeout_millis=10000,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,17 @@
 #  Copyright (c) 2023. Mihir Samdarshi/MoTrPAC Bioinformatics Center
 
+import threading
 import unittest
 from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 
-from motrpac_backend_utils.threadpool import threadpool
+from motrpac_backend_utils.threadpool import submit_with_context, threadpool
 
 
 # Example function to be decorated
 @threadpool
 def square(x: int) -> int:
-    return x**2
+    return x * x
 
 
 class TestThreadpoolDecorator(unittest.TestCase):
@@ -19,18 +21,50 @@ class TestThreadpoolDecorator(unittest.TestCase):
         assert squared_num.result() == 25
 
         # Test using a custom thread pool
-        custom_pool = ThreadPoolExecutor(max_workers=2)
-
-        @threadpool
-        def re_square(x: int) -> int:
-            return x**2
+        custom_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="custom")
 
+        re_square = threadpool(pool=custom_pool)(square.__wrapped__)
         squared_num = re_square(3)
         assert squared_num.result() == 9
 
+        @threadpool(pool=custom_pool)
+        def thread_name() -> str:
+            return threading.current_thread().name
+
+        assert thread_name().result().startswith("custom")
+
         # Clean up the custom thread pool
         custom_pool.shutdown()
 
+    def test_threadpool_propagates_context(self) -> None:
+        request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+        @threadpool
+        def get_request_id() -> str | None:
+            return request_id.get()
+
+        token = request_id.set("abc")
+        try:
+            future = get_request_id()
+        finally:
+            request_id.reset(token)
+
+        assert future.result() == "abc"
+
+    def test_submit_with_context(self) -> None:
+        request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+        token = request_id.set("abc")
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = [
+                    submit_with_context(pool, request_id.get) for _ in range(100)
+                ]
+                results = {f.result() for f in futures}
+        finally:
+            request_id.reset(token)
+
+        assert results == {"abc"}
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+#  Copyright (c) 2024. Mihir Samdarshi/MoTrPAC Bioinformatics Center
+
+import unittest
+from unittest import mock
+
+from motrpac_backend_utils import utils
+from motrpac_backend_utils.utils import (
+    _get_credentials,
+    generate_file_hash,
+    get_authorized_session,
+)
+
+
+class TestGetAuthorizedSession(unittest.TestCase):
+    def setUp(self) -> None:
+        _get_credentials.cache_clear()
+        self.addCleanup(_get_credentials.cache_clear)
+        # every test patches the session and request classes, tests only patch the
+        # credential source they expect to be used
+        request_patcher = mock.patch.object(utils, "Request")
+        self.mock_request = request_patcher.start()
+        self.addCleanup(request_patcher.stop)
+        session_patcher = mock.patch.object(utils, "AuthorizedSession")
+        self.mock_session = session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+
+    def test_credentials_are_reused_per_audience(self) -> None:
+        with mock.patch.dict(
+            "os.environ",
+            {"PRODUCTION_DEPLOYMENT": "1"},
+        ), mock.patch.object(utils, "IDTokenCredentials") as mock_credentials:
+            get_authorized_session("https://example.com/a")
+            get_authorized_session("https://example.com/a")
+            get_authorized_session("https://example.com/b")
+
+        assert mock_credentials.call_count == 2
+        assert self.mock_session.call_count == 3
+
+    def test_get_authorized_session(self) -> None:
+        # (PRODUCTION_DEPLOYMENT, max refresh attempts, expected credential source)
+        cases = [
+            ("0", 100, "default"),
+            ("1", 100, "id_token"),
+            ("0", 50, "default"),
+        ]
+        for prod_env, max_attempts, expected_source in cases:
+            with self.subTest(prod_env=prod_env, max_attempts=max_attempts):
+                _get_credentials.cache_clear()
+                self.mock_session.reset_mock()
+                with mock.patch.dict(
+                    "os.environ",
+                    {"PRODUCTION_DEPLOYMENT": prod_env},
+                ), mock.patch.object(
+                    utils.google.auth,
+                    "default",
+                    return_value=("default", "project"),
+                ), mock.patch.object(
+                    utils,
+                    "IDTokenCredentials",
+                    return_value="id_token",
+                ):
+                    session = get_authorized_session(
+                        "https://example.com",
+                        max_refresh_attempts=max_attempts,
+                    )
+
+                assert session is self.mock_session.return_value
+                self.mock_session.assert_called_once_with(
+                    expected_source,
+                    max_refresh_attempts=max_attempts,
+                )
+
+
+class TestGenerateFileHash(unittest.TestCase):
+    def test_generate_file_hash(self) -> None:
+        # (files, expected sorted files, expected MD5 hash)
+        cases = [
+            ([], [], "d41d8cd98f00b204e9800998ecf8427e"),
+            (["b.txt"], ["b.txt"], "ce506ace22f28ac2bc4f933d4cf989fd"),
+            (
+                ["b.txt", "a.txt", "c.txt"],
+                ["a.txt", "b.txt", "c.txt"],
+                "ba3e057c46f4a4a5cd8d95d03d1c0871",
+            ),
+        ]
+        for files, expected_sorted, expected_md5 in cases:
+            with self.subTest(files=files):
+                sorted_files, md5_hash = generate_file_hash(files)
+                assert sorted_files == expected_sorted
+                assert md5_hash == expected_md5
+
+
+if __name__ == "__main__":
+    unittest.main()
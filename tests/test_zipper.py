@@ -1,48 +1,228 @@
 #  Copyright (c) 2023. Mihir Samdarshi/MoTrPAC Bioinformatics Center
 
-import math
+import base64
+import io
+import json
+import queue
+import tempfile
 import unittest
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from unittest.mock import MagicMock
+from types import SimpleNamespace
+from typing import BinaryIO, Literal, TYPE_CHECKING
+from unittest.mock import DEFAULT, MagicMock, patch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
-from motrpac_backend_utils.zipper import estimate_remaining_time, ZipUploader
+import google_crc32c
+import pytest
+import requests
+from google.cloud.storage import Blob, Bucket, Client as StorageClient
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.exceptions import DataCorruption
+
+from motrpac_backend_utils.requester import Requester
+from motrpac_backend_utils.zipper import (
+    END_OF_FILES,
+    STORAGE_CONNECTION_POOL_SIZE,
+    download_sliced,
+    estimate_remaining_time,
+    get_storage_client,
+    write_json_to_archive,
+    zip_file_writer,
+    ZipUploader,
+)
+from motrpac_backend_utils.zipper.utils import (
+    MANIFEST_ERROR_SUFFIX,
+    default_to_regular,
+    get_path_dict,
+    nested_dict,
+)
+
+if TYPE_CHECKING:
+    from multiprocessing import JoinableQueue
 
 
 class TestEstimateRemainingTime(unittest.TestCase):
     def test_estimate_remaining_time(self) -> None:
-        # Arrange
-        current_file_count = 5
-        total_file_count = 20
-        elapsed_time = 60.0
-
-        # Act
-        remaining_time = estimate_remaining_time(
-            current_file_count, total_file_count, elapsed_time,
-        )
+        # (current file count, total file count, elapsed time, expected remaining time)
+        cases = [
+            (1, 10, 10.0, 135),
+            (5, 20, 60.0, 270),
+            (10, 10, 30.0, 0),
+            (1, 100, 60.0, 600),
+        ]
+        for current, total, elapsed, expected in cases:
+            with self.subTest(current=current, total=total, elapsed=elapsed):
+                assert estimate_remaining_time(current, total, elapsed) == expected
+
+    def test_estimate_remaining_time_before_first_file(self) -> None:
+        assert estimate_remaining_time(0, 20, 60.0) == 600
+
+
+class TestGetPathDict(unittest.TestCase):
+    def test_get_path_dict_skips_errors(self) -> None:
+        paths = [
+            "a/b/file1.txt",
+            "a/file2.txt",
+            f"a/b/missing.txt{MANIFEST_ERROR_SUFFIX}",
+        ]
+
+        path_dict = get_path_dict(paths)
+
+        assert path_dict == {
+            "a": {"b": {"contents": ["file1.txt"]}, "contents": ["file2.txt"]},
+        }
+
+
+class TestZipFileWriter(unittest.TestCase):
+    def test_zip_file_writer(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prefix = Path(tmp_dir)
+            (prefix / "data").mkdir()
+            text_file = prefix / "data" / "file1.txt"
+            text_file.write_text("hello world")
+            gz_file = prefix / "data" / "file2.txt.gz"
+            gz_file.write_bytes(b"already compressed")
+
+            file_queue = queue.Queue()
+            file_queue.put(str(text_file))
+            file_queue.put(str(gz_file))
+            file_queue.put(END_OF_FILES)
+
+            buffer = io.BytesIO()
+            path_dict = nested_dict()
+            with ZipFile(buffer, mode="w", compression=ZIP_DEFLATED) as archive:
+                manifest = zip_file_writer(
+                    file_queue, archive, "hash123", None, prefix, path_dict,
+                )
+
+        assert manifest == [str(text_file), str(gz_file)]
+        assert default_to_regular(path_dict) == get_path_dict(manifest)
+        with ZipFile(buffer) as archive:
+            assert archive.getinfo("data/file1.txt").compress_type == ZIP_DEFLATED
+            assert archive.getinfo("data/file2.txt.gz").compress_type == ZIP_STORED
+            assert archive.read("data/file1.txt") == b"hello world"
+
+
+class TestWriteJsonToArchive(unittest.TestCase):
+    def test_write_json_to_archive(self) -> None:
+        buffer = io.BytesIO()
+        manifest = ["data/file1.txt", "data/file2.txt"]
+        with ZipFile(buffer, mode="w", compression=ZIP_DEFLATED) as archive:
+            write_json_to_archive(archive, "list.manifest.json", manifest)
 
-        # Assert
-        expected_remaining_time = math.ceil(
-            (elapsed_time / current_file_count)
-            * (total_file_count - current_file_count)
-            * 1.5,
+        with ZipFile(buffer) as archive:
+            assert json.loads(archive.read("list.manifest.json")) == manifest
+
+
+class TestDownloadSliced(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = bytes(range(64))
+        # only the properties that ZipUploader.list_blobs requests
+        bucket = Bucket(StorageClient.create_anonymous_client(), "input_bucket")
+        self.blob = Blob("data/file.bam", bucket)
+        self.blob._set_properties(  # noqa: SLF001
+            {
+                "name": "data/file.bam",
+                "size": str(len(self.data)),
+                "generation": "1",
+                "crc32c": base64.b64encode(
+                    google_crc32c.value(self.data).to_bytes(4, "big"),
+                ).decode(),
+            },
         )
-        expected_remaining_time = min(expected_remaining_time, 600)
-        assert remaining_time == expected_remaining_time
+
+    def download_sliced(self, path: Path) -> MagicMock:
+        data = self.data
+
+        def fake_download(
+            _blob: Blob,
+            file_obj: BinaryIO,
+            start: int,
+            end: int,
+            **_kwargs: object,
+        ) -> None:
+            file_obj.write(data[start : end + 1])
+
+        # each 16 byte chunk is fetched with a stubbed range request, the checksums of
+        # the chunks are still combined and checked against the blob's crc32c
+        with patch.object(
+            Blob, "_prep_and_do_download", autospec=True, side_effect=fake_download,
+        ), patch(
+            "motrpac_backend_utils.zipper.SLICED_DOWNLOAD_CHUNK_SIZE", 16,
+        ), patch(
+            "motrpac_backend_utils.zipper.transfer_manager.download_chunks_concurrently",
+            wraps=transfer_manager.download_chunks_concurrently,
+        ) as mock_download:
+            download_sliced(self.blob, path)
+        return mock_download
+
+    def test_download_sliced(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "file.bam"
+            mock_download = self.download_sliced(path)
+
+            assert path.read_bytes() == self.data
+            assert not path.with_name("file.bam.part").exists()
+            assert mock_download.call_args.kwargs["max_workers"] == 4
+
+    def test_download_sliced_checksum_mismatch(self) -> None:
+        self.blob._properties["crc32c"] = base64.b64encode(  # noqa: SLF001
+            b"\x00\x00\x00\x00",
+        ).decode()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "file.bam"
+            with pytest.raises(DataCorruption):
+                self.download_sliced(path)
+
+            assert not path.exists()
+            assert not path.with_name("file.bam.part").exists()
+
+
+class TestGetStorageClient(unittest.TestCase):
+    def test_get_storage_client_per_process(self) -> None:
+        with patch(
+            "motrpac_backend_utils.zipper.StorageClient",
+            side_effect=MagicMock,
+        ), patch("motrpac_backend_utils.zipper._storage_client", None), patch(
+            "motrpac_backend_utils.zipper.os.getpid",
+            return_value=1,
+        ) as mock_getpid:
+            client = get_storage_client()
+            assert get_storage_client() is client
+            client._http.mount.assert_called_once()  # noqa: SLF001
+
+            # a forked child process gets its own client
+            mock_getpid.return_value = 2
+            assert get_storage_client() is not client
 
 
 class TestZipUploader(unittest.TestCase):
+    def setUp(self) -> None:
+        # plain stubs with only the attributes ZipUploader uses, they are cheap enough to
+        # build for every test, unlike mocks
+        self.storage_client = SimpleNamespace(
+            get_bucket=lambda name: SimpleNamespace(name=name),
+        )
+        self.in_progress_cache = SimpleNamespace()
+        self.requesters = [
+            Requester(name="John Doe", email="johndoe@example.com", id="1"),
+            Requester(name="Jane Doe", email="janedoe@example.com", id=None),
+        ]
+        self.message = SimpleNamespace(_received_timestamp=0.0)
+
     def test_create_zip(self) -> None:
         files = ["file1.txt", "file2.txt"]
         file_hash = "hash123"
         notification_url = "https://example.com/notification"
-        storage_client = MagicMock()
+        storage_client = self.storage_client
         input_bucket = "input_bucket"
         output_bucket = "output_bucket"
-        scratch_location = Path("/tmp/scratch")
-        file_dl_location = Path("/tmp/file_cache")
-        in_progress_cache = MagicMock()
-        requesters = [MagicMock(), MagicMock()]
-        message = MagicMock()
+        file_dl_location = Path("/tmp/file_cache")  # noqa: S108
+        in_progress_cache = self.in_progress_cache
+        requesters = self.requesters
+        message = self.message
         ack_deadline = 600
 
         zip_uploader = ZipUploader(
@@ -52,7 +232,6 @@ class TestZipUploader(unittest.TestCase):
             storage_client=storage_client,
             input_bucket=input_bucket,
             output_bucket=output_bucket,
-            scratch_location=scratch_location,
             file_dl_location=file_dl_location,
             in_progress_cache=in_progress_cache,
             requesters=requesters,
@@ -60,21 +239,205 @@ class TestZipUploader(unittest.TestCase):
             ack_deadline=ack_deadline,
         )
 
-        # Mock the necessary methods and attributes
-        zip_uploader.setup_processing = MagicMock()
-        zip_uploader.create_zip = MagicMock()
-        zip_uploader.check_zip_exists_in_bucket = MagicMock()
-        zip_uploader.send_notification = MagicMock()
-        zip_uploader.successful_result = MagicMock()
-
-        zip_uploader.process_and_notify_requesters()
+        # Mock the necessary methods
+        methods = (
+            "setup_processing",
+            "create_zip",
+            "check_zip_exists_in_bucket",
+            "send_notification",
+            "successful_result",
+        )
+        with patch.multiple(
+            zip_uploader, **dict.fromkeys(methods, DEFAULT),
+        ) as patched:
+            zip_uploader.process_and_notify_requesters()
 
         # Assertions
-        zip_uploader.setup_processing.assert_called_once()
-        zip_uploader.create_zip.assert_called_once()
-        zip_uploader.check_zip_exists_in_bucket.assert_called_once()
-        zip_uploader.send_notification.assert_called_once()
-        zip_uploader.successful_result.assert_called_once()
+        for method in methods:
+            patched[method].assert_called_once()
+
+    def test_scratch_location_is_deprecated(self) -> None:
+        with pytest.warns(DeprecationWarning, match="scratch_location"):
+            ZipUploader(
+                files=["data/file1.txt"],
+                file_hash="hash123",
+                notification_url="https://example.com/notification",
+                storage_client=self.storage_client,
+                input_bucket="input_bucket",
+                output_bucket="output_bucket",
+                scratch_location=Path("scratch"),
+                requesters=self.requesters,
+            )
+
+    def test_setup_processing_pools_download_connections(self) -> None:
+        storage_client = MagicMock()
+        storage_client._http = session = requests.Session()  # noqa: SLF001
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_uploader = ZipUploader(
+                files=["data/file1.txt"],
+                file_hash="hash123",
+                notification_url="https://example.com/notification",
+                storage_client=storage_client,
+                input_bucket="input_bucket",
+                output_bucket="output_bucket",
+                file_dl_location=Path(tmp_dir),
+                requesters=self.requesters,
+            )
+            with patch.object(zip_uploader, "list_blobs", return_value={}):
+                zip_uploader.setup_processing()
+                adapter = session.adapters["https://"]
+                # set up again, e.g. by the next request, the pool is kept
+                zip_uploader.setup_processing()
+
+        assert session.adapters["https://"] is adapter
+        assert (
+            adapter.poolmanager.connection_pool_kw["maxsize"]
+            == STORAGE_CONNECTION_POOL_SIZE
+        )
+
+    def test_list_blobs(self) -> None:
+        files = [
+            "data/file1.txt",
+            "data/file2.txt",
+            "data/missing.txt",
+            "other/file3.txt",
+        ]
+        listed = {
+            "data/": [
+                "data/file1.txt",
+                "data/file2.txt",
+                "data/not_requested.txt",
+                # past the last requested file, the listing stops before it
+                "data/zzz.txt",
+            ],
+        }
+        storage_client = MagicMock()
+        input_bucket = storage_client.get_bucket.return_value
+
+        def fake_list_blobs(
+            prefix: str,
+            start_offset: str,
+            **_kwargs: object,
+        ) -> Iterator[Blob]:
+            for name in listed[prefix]:
+                assert name != "data/zzz.txt"
+                if name >= start_offset:
+                    yield Blob(name, input_bucket)
+
+        input_bucket.list_blobs.side_effect = fake_list_blobs
+
+        zip_uploader = ZipUploader(
+            files=files,
+            file_hash="hash123",
+            notification_url="https://example.com/notification",
+            storage_client=storage_client,
+            input_bucket="input_bucket",
+            output_bucket="output_bucket",
+            requesters=[MagicMock()],
+        )
+        with patch("motrpac_backend_utils.zipper.LIST_DIRECTORY_MIN_FILES", 2):
+            blobs = zip_uploader.list_blobs()
+
+        # "other/" has too few requested files to be listed
+        assert sorted(blobs) == ["data/file1.txt", "data/file2.txt", "data/missing.txt"]
+        assert blobs["data/missing.txt"] is None
+        input_bucket.list_blobs.assert_called_once()
+        list_kwargs = input_bucket.list_blobs.call_args.kwargs
+        assert list_kwargs["start_offset"] == "data/file1.txt"
+        assert list_kwargs["fields"] == "items(name,size,generation,crc32c),nextPageToken"
+
+    def test_sparse_files_are_fetched_individually(self) -> None:
+        def fake_download(filename: str) -> None:
+            Path(filename).write_bytes(b"data")
+
+        storage_client = MagicMock()
+        storage_client._http = requests.Session()  # noqa: SLF001
+        input_bucket = storage_client.get_bucket.return_value
+        input_bucket.get_blob.return_value.size = 4
+        input_bucket.get_blob.return_value.download_to_filename.side_effect = (
+            fake_download
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_uploader = ZipUploader(
+                files=["data/file1.txt"],
+                file_hash="hash123",
+                notification_url="https://example.com/notification",
+                storage_client=storage_client,
+                input_bucket="input_bucket",
+                output_bucket="output_bucket",
+                file_dl_location=Path(tmp_dir),
+                requesters=self.requesters,
+            )
+            # a single file is not worth listing its whole directory for
+            zip_uploader.setup_processing()
+            input_bucket.list_blobs.assert_not_called()
+
+            path = zip_uploader.get_file("data/file1.txt").result()
+            assert path.read_bytes() == b"data"
+            input_bucket.get_blob.assert_called_once_with("data/file1.txt")
+
+    def test_get_file_downloads_once(self) -> None:
+        def fake_download(filename: str) -> None:
+            Path(filename).write_bytes(b"data")
+
+        blob = MagicMock(size=4)
+        blob.download_to_filename.side_effect = fake_download
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_uploader = ZipUploader(
+                files=["data/file1.txt"],
+                file_hash="hash123",
+                notification_url="https://example.com/notification",
+                storage_client=self.storage_client,
+                input_bucket="input_bucket",
+                output_bucket="output_bucket",
+                file_dl_location=Path(tmp_dir),
+                requesters=self.requesters,
+            )
+            zip_uploader.blobs = {"data/file1.txt": blob}
+
+            path = zip_uploader.get_file("data/file1.txt").result()
+            assert zip_uploader.get_file("data/file1.txt").result() == path
+            assert path.read_bytes() == b"data"
+            assert not path.with_name("file1.txt.lock").exists()
+            blob.download_to_filename.assert_called_once()
+
+    def test_create_zip_hands_off_all_files(self) -> None:
+        files = [f"data/file{i}.txt" for i in range(10)]
+        with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor() as pool:
+            zip_uploader = ZipUploader(
+                files=files,
+                file_hash="hash123",
+                notification_url="https://example.com/notification",
+                storage_client=self.storage_client,
+                input_bucket="input_bucket",
+                output_bucket="output_bucket",
+                file_dl_location=Path(tmp_dir),
+                requesters=self.requesters,
+            )
+            # "download" a file by returning its local path
+            zip_uploader.get_file = MagicMock(
+                side_effect=lambda file: pool.submit(Path, tmp_dir, file),
+            )
+            manifest_path = Path(tmp_dir) / "manifest.json"
+
+            def fake_add_to_zip(
+                queue: "JoinableQueue[str | Literal[False]]",
+                file_path_prefix: Path,
+                **_kwargs: object,
+            ) -> None:
+                manifest = zip_file_writer(
+                    queue, MagicMock(), "hash123", None, file_path_prefix,
+                )
+                manifest_path.write_text(json.dumps(manifest))
+
+            with patch(
+                "motrpac_backend_utils.zipper.add_to_zip",
+                fake_add_to_zip,
+            ), patch("motrpac_backend_utils.zipper.MAX_CONCURRENT_DOWNLOADS", 3):
+                zip_uploader.create_zip()
+
+            manifest = json.loads(manifest_path.read_text())
+            assert sorted(manifest) == sorted(str(Path(tmp_dir) / f) for f in files)
 
 
 if __name__ == "__main__":